@@ -1,13 +1,37 @@
 from flask import Flask, jsonify, request, abort
 from flask_cors import CORS
+from sqlalchemy import exc
 import datetime
 
-from models import setup_db, Swimmer, Meet, Result
+from models import (setup_db, db, refresh_meet_leaderboard, Swimmer, Meet, Result,
+                    SWIMMER_SEARCH_TEXT, MEET_SEARCH_TEXT)
 from auth import AuthError, requires_auth
+from pagination import paginate, get_page_size
+from streaming import wants_stream, ndjson_response
+from export import export_response, EXPORT_FORMATS, EXPORT_COLUMNS
+from filters import (filter_results, get_int_arg, get_choice_arg, get_ids_arg, lookup_ids,
+                     STROKES, COURSES, GENDERS)
+from rankings import personal_bests, rankings, rankings_page, get_rankings_cursor, format_ranking
+from search import search, get_search_arg, get_search_limit
+from ingest import read_rows, validate_rows, insert_rows
+from cache import setup_cache, cached, invalidate, result_tags
+from reads import read_view
+from replicas import setup_replicas
+from metrics import metrics_response
+from timing import setup_timing
+from compression import setup_compression
+from live import setup_live_results, event_stream, queue_events, inserted_events
+from serializers import (SWIMMER_COLUMNS, MEET_COLUMNS, RESULT_COLUMNS,
+                         format_swimmer, format_meet, format_result, json_response)
 
 
 app = Flask(__name__)
 setup_db(app)
+setup_cache(app)
+setup_replicas(app)
+setup_live_results(app)
+setup_timing(app)
+setup_compression(app)
 CORS(app)
 
 
@@ -17,16 +41,34 @@ def get_greeting():
     return greeting
 
 
+@app.route('/metrics')
+def get_metrics():
+    return metrics_response()
+
+
 @app.route('/swimmers', methods=['GET'])
 @requires_auth('get:swimmers')
+@cached('swimmers')
+@read_view
 def get_swimmers(payload):
-    swimmers = Swimmer.query.all()
+    ids = get_ids_arg()
+    if ids is not None:
+        swimmers, missing = yield from lookup_ids(db.session.query(*SWIMMER_COLUMNS), Swimmer.id, ids)
+        response = {
+            'success': True,
+            'swimmers': [format_swimmer(swimmer) for swimmer in swimmers],
+            'missing': missing
+        }
+        return json_response(response)
+
+    swimmers, cursor = yield from paginate(db.session.query(*SWIMMER_COLUMNS), Swimmer.id)
 
     response = {
         'success': True,
-        'swimmers': [swimmer.format() for swimmer in swimmers]
+        'swimmers': [format_swimmer(swimmer) for swimmer in swimmers],
+        'next': cursor
     }
-    return jsonify(response)
+    return json_response(response)
 
 
 @app.route('/swimmers', methods=['POST'])
@@ -64,32 +106,57 @@ def create_swimmer(payload):
 
 @app.route('/swimmers/<int:swimmer_id>', methods=['GET'])
 @requires_auth('get:swimmer-details')
+@cached('swimmer:{swimmer_id}')
+@read_view
 def get_swimmer_details(payload, swimmer_id):
-    swimmer = Swimmer.query.filter(Swimmer.id == swimmer_id).one_or_none()
+    swimmers = yield db.session.query(*SWIMMER_COLUMNS).filter(Swimmer.id == swimmer_id)
 
-    if not swimmer:
+    if not swimmers:
         abort(404)
 
     response = {
         'success': True,
-        'swimmer': swimmer.format()
+        'swimmer': format_swimmer(swimmers[0])
     }
-    return jsonify(response)
+    return json_response(response)
 
 
 @app.route('/swimmers/<int:swimmer_id>/results', methods=['GET'])
 @requires_auth('get:swimmer-results')
+@cached('swimmer:{swimmer_id}', 'results:swimmer:{swimmer_id}')
+@read_view
 def get_swimmer_results(payload, swimmer_id):
-    swimmer = Swimmer.query.filter(Swimmer.id == swimmer_id).one_or_none()
+    # one query: the outer join yields a single row without result for a swimmer without results
+    rows = yield (db.session.query(Swimmer.id.label('swimmer'), *RESULT_COLUMNS)
+                  .outerjoin(Result, Result.swimmer_id == Swimmer.id)
+                  .filter(Swimmer.id == swimmer_id)
+                  .order_by(Result.id))
 
-    if not swimmer:
+    if not rows:
         abort(404)
 
     response = {
         'success': True,
-        'results': [result.format() for result in swimmer.results]
+        'results': [format_result(row) for row in rows if row.id is not None]
     }
-    return jsonify(response)
+    return json_response(response)
+
+
+@app.route('/swimmers/<int:swimmer_id>/personal-bests', methods=['GET'])
+@requires_auth('get:swimmer-results')
+@cached('swimmer:{swimmer_id}', 'results:swimmer:{swimmer_id}')
+@read_view
+def get_swimmer_personal_bests(payload, swimmer_id):
+    results = yield personal_bests(swimmer_id)
+
+    if not results and not (yield db.session.query(Swimmer.id).filter(Swimmer.id == swimmer_id)):
+        abort(404)
+
+    response = {
+        'success': True,
+        'personal bests': [format_result(result) for result in results]
+    }
+    return json_response(response)
 
 
 @app.route('/swimmers/<int:swimmer_id>', methods=['PATCH'])
@@ -142,14 +209,27 @@ def delete_swimmer(payload, swimmer_id):
 
 @app.route('/meets', methods=['GET'])
 @requires_auth('get:meets')
+@cached('meets')
+@read_view
 def get_meets(payload):
-    meets = Meet.query.all()
+    ids = get_ids_arg()
+    if ids is not None:
+        meets, missing = yield from lookup_ids(db.session.query(*MEET_COLUMNS), Meet.id, ids)
+        response = {
+            'success': True,
+            'meets': [format_meet(meet) for meet in meets],
+            'missing': missing
+        }
+        return json_response(response)
+
+    meets, cursor = yield from paginate(db.session.query(*MEET_COLUMNS), Meet.id)
 
     response = {
         'success': True,
-        'meets': [meet.format() for meet in meets]
+        'meets': [format_meet(meet) for meet in meets],
+        'next': cursor
     }
-    return jsonify(response)
+    return json_response(response)
 
 
 @app.route('/meets', methods=['POST'])
@@ -189,30 +269,94 @@ def create_meet(payload):
 
 @app.route('/meets/<int:meet_id>', methods=['GET'])
 @requires_auth('get:meet-details')
+@cached('meet:{meet_id}')
+@read_view
 def get_meet_details(payload, meet_id):
-    meet = Meet.query.filter(Meet.id == meet_id).one_or_none()
+    meets = yield db.session.query(*MEET_COLUMNS).filter(Meet.id == meet_id)
 
-    if not meet:
+    if not meets:
         abort(404)
 
     response = {
         'success': True,
-        'meet': meet.format()
+        'meet': format_meet(meets[0])
     }
-    return jsonify(response)
+    return json_response(response)
 
 
 @app.route('/meets/<int:meet_id>/results', methods=['GET'])
 @requires_auth('get:meet-results')
+@cached('meet:{meet_id}', 'results:meet:{meet_id}')
+@read_view
 def get_meet_results(payload, meet_id):
-    meet = Meet.query.filter(Meet.id == meet_id).one_or_none()
+    # one query: the outer join yields a single row without result for a meet without results
+    rows = yield (db.session.query(Meet.id.label('meet'), *RESULT_COLUMNS)
+                  .outerjoin(Result, Result.meet_id == Meet.id)
+                  .filter(Meet.id == meet_id)
+                  .order_by(Result.id))
+
+    if not rows:
+        abort(404)
+
+    response = {
+        'success': True,
+        'results': [format_result(row) for row in rows if row.id is not None]
+    }
+    return json_response(response)
+
+
+@app.route('/meets/<int:meet_id>/results/stream', methods=['GET'])
+@requires_auth('get:meet-results')
+def stream_meet_results(payload, meet_id):
+    if not db.session.query(Meet.id).filter(Meet.id == meet_id).one_or_none():
+        abort(404)
+
+    def snapshot():
+        return (db.session.query(*RESULT_COLUMNS)
+                .filter(Result.meet_id == meet_id)
+                .order_by(Result.id)
+                .all())
+
+    response = event_stream(meet_id, snapshot, expires=payload.get('exp'))
+    if response is None:
+        abort(503)
+    return response
+
 
+@app.route('/meets/<int:meet_id>/results:bulk', methods=['POST'])
+@requires_auth('create:results')
+def create_meet_results(payload, meet_id):
+    meet = Meet.query.filter(Meet.id == meet_id).one_or_none()
     if not meet:
         abort(404)
 
+    rows, errors = validate_rows(meet, read_rows())
+    partial = request.args.get('partial') == '1'
+
+    if errors and not partial:
+        return jsonify({
+            'success': False,
+            'error': 400,
+            'message': 'Bad request',
+            'errors': errors
+        }), 400
+
+    try:
+        ids = insert_rows(rows)
+        refresh_meet_leaderboard(db.session.connection(), meet_id)
+        queue_events(db.session, inserted_events(ids, rows))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        abort(400)
+
+    # the multi-row insert bypasses the ORM events that invalidate the cache
+    invalidate(sorted({tag for row in rows for tag in result_tags(row['swimmer_id'], meet_id)}))
+
     response = {
         'success': True,
-        'results': [result.format() for result in meet.results]
+        'ids': ids,
+        'errors': errors
     }
     return jsonify(response)
 
@@ -269,14 +413,76 @@ def delete_meet(payload, meet_id):
 
 @app.route('/results', methods=['GET'])
 @requires_auth('get:results')
+@cached('results', 'swimmers', 'meets')
+@read_view
 def get_results(payload):
-    results = Result.query.all()
+    query, order = filter_results(db.session.query(*RESULT_COLUMNS))
+
+    if wants_stream():
+        return ndjson_response(query.order_by(*order), format_result)
+
+    results, cursor = yield from paginate(query, *order)
 
     response = {
         'success': True,
-        'results': [result.format() for result in results]
+        'results': [format_result(result) for result in results],
+        'next': cursor
     }
-    return jsonify(response)
+    return json_response(response)
+
+
+@app.route('/export/results', methods=['GET'])
+@requires_auth('get:results')
+def export_results(payload):
+    export_format = get_choice_arg('format', EXPORT_FORMATS) or 'csv'
+    query, order = filter_results(db.session.query(*EXPORT_COLUMNS))
+    return export_response(query.order_by(*order), export_format)
+
+
+@app.route('/rankings', methods=['GET'])
+@requires_auth('get:results')
+@cached('results', 'swimmers', 'meets')
+@read_view
+def get_rankings(payload):
+    stroke = get_choice_arg('stroke', STROKES)
+    distance = get_int_arg('distance')
+    course = get_choice_arg('course', COURSES)
+    gender = get_choice_arg('gender', GENDERS)
+    season = get_int_arg('season')
+
+    if stroke is None or distance is None or course is None:
+        abort(400)
+
+    after = get_rankings_cursor()
+    limit = get_page_size()
+    rows = yield rankings(stroke, distance, course, gender=gender, season=season,
+                          limit=limit + 1, after=after[:2] if after is not None else None)
+    rows, ranks, cursor = rankings_page(rows, limit, after)
+
+    response = {
+        'success': True,
+        'rankings': [format_ranking(row, rank) for row, rank in zip(rows, ranks)],
+        'next': cursor
+    }
+    return json_response(response)
+
+
+@app.route('/search', methods=['GET'])
+@requires_auth('get:swimmers', 'get:meets')
+@cached('swimmers', 'meets')
+@read_view
+def search_swimmers_and_meets(payload):
+    term = get_search_arg()
+    limit = get_search_limit()
+    swimmers = yield search(db.session.query(*SWIMMER_COLUMNS), SWIMMER_SEARCH_TEXT, Swimmer.id, term, limit)
+    meets = yield search(db.session.query(*MEET_COLUMNS), MEET_SEARCH_TEXT, Meet.id, term, limit)
+
+    response = {
+        'success': True,
+        'swimmers': [format_swimmer(swimmer) for swimmer in swimmers],
+        'meets': [format_meet(meet) for meet in meets]
+    }
+    return json_response(response)
 
 
 '''
@@ -338,5 +544,20 @@ def not_found(error):
     }), 405
 
 
+@app.errorhandler(503)
+def service_unavailable(error):
+    return jsonify({
+        "success": False,
+        "error": 503,
+        "message": "Service unavailable"
+    }), 503
+
+
+@app.errorhandler(exc.TimeoutError)
+def pool_timeout(error):
+    # no database connection became free within DB_POOL_TIMEOUT
+    return service_unavailable(error)
+
+
 if __name__ == '__main__':
     app.run()
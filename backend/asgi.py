@@ -0,0 +1,194 @@
+"""ASGI entry point, an alternative to serving app.py with gunicorn
+
+    uvicorn asgi:app --workers 4
+
+Serves the routes of the Flask app in app.py with the same authentication,
+caching and responses. Read views (see reads.read_view) run in the event
+loop with their queries awaited on an asyncpg pool, so a request waiting
+for Postgres does not hold a thread. Like in the Flask app, they read from
+a replica if DATABASE_REPLICA_URLS is set. All other requests, i.e. writes
+and streams, are passed on to the Flask app in a thread pool.
+"""
+import os
+import asyncio
+import inspect
+from collections import namedtuple
+from functools import lru_cache
+from asyncpg.exceptions import CannotConnectNowError, InterfaceError, PostgresConnectionError
+from databases import Database
+from flask import request
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware.wsgi import WSGIMiddleware, build_environ
+from werkzeug.exceptions import HTTPException
+
+from app import app as flask_app
+from auth import authenticate, token_cache
+from cache import cache_lookup, cache_store
+from models import database_path, replica_paths, ReplicaSet, DB_STATEMENT_TIMEOUT
+from reads import advance
+from replicas import reads_from_replica
+
+
+# connections of the asyncpg pool per worker process
+ASYNC_POOL_SIZE = int(os.environ.get('ASYNC_POOL_SIZE', 10))
+
+database = Database(database_path, min_size=1, max_size=ASYNC_POOL_SIZE,
+                    server_settings={'statement_timeout': str(DB_STATEMENT_TIMEOUT)})
+# replicas connect on first use, so one that is down does not stop the startup
+replicas = ReplicaSet(Database(path, min_size=0, max_size=ASYNC_POOL_SIZE,
+                               server_settings={'statement_timeout': str(DB_STATEMENT_TIMEOUT)})
+                      for path in replica_paths)
+wsgi_app = WSGIMiddleware(flask_app)
+# errors of a replica that is down, starting up or dropped the connection; InterfaceError
+# covers ConnectionDoesNotExistError and the other errors of a closed connection
+DISCONNECT_ERRORS = (OSError, asyncio.TimeoutError, InterfaceError, PostgresConnectionError,
+                     CannotConnectNowError)
+
+# views decorated with read_view; functools.wraps copies the attributes
+# set by requires_auth and cached onto the outermost wrapper
+read_views = {endpoint: view for endpoint, view in flask_app.view_functions.items()
+              if hasattr(view, 'read_steps')}
+
+Pending = namedtuple('Pending', ['steps', 'lookup', 'database', 'statement'])
+
+
+@lru_cache(maxsize=256)
+def row_type(keys):
+    return namedtuple('Row', keys)
+
+
+async def fetch(database, statement):
+    """Returns the rows of a statement with attribute access, like the rows of Query.all()
+
+    A replica that cannot be reached is ejected, see models.ReplicaSet.
+    """
+    try:
+        records = await database.fetch_all(statement)
+    except DISCONNECT_ERRORS:
+        if database in replicas.members:
+            replicas.eject(database)
+        raise
+    if not records:
+        return []
+    Row = row_type(tuple(records[0].keys()))
+    return [Row(*record.values()) for record in records]
+
+
+def in_request(environ, step, *args):
+    """Runs a synchronous step of a request inside a Flask request context
+
+    Flask's context locals are per thread, not per task, so a context is
+    never kept across an await; each step gets a fresh one. Errors are
+    turned into responses by the Flask error handlers, and responses pass
+    the Flask after-request hooks, e.g. CORS, as in app.py, exactly once.
+    """
+    with flask_app.request_context(environ):
+        try:
+            result = step(*args)
+        except Exception as error:
+            try:
+                result = flask_app.handle_user_exception(error)
+            except Exception as error:
+                # the response of an unhandled error is finalized by Flask itself
+                return flask_app.handle_exception(error)
+        if isinstance(result, Pending) or result is None:
+            return result
+        return flask_app.finalize_request(result)
+
+
+def begin(view, kwargs):
+    payload = authenticate(*view.permissions)
+    lookup = None
+    tags = getattr(view, 'cache_tags', None)
+    if tags is not None:
+        lookup, response = cache_lookup([tag.format(**kwargs) for tag in tags])
+        if response is not None:
+            return response
+    steps = view.read_steps(payload, **kwargs)
+    if not inspect.isgenerator(steps):
+        return steps
+    source = database
+    if replicas.members and reads_from_replica(view, request.method, request.headers):
+        source = replicas.choose() or database
+    return proceed(steps, lookup, source)
+
+
+def proceed(steps, lookup, source, rows=None):
+    """Runs a read view up to its next query on the given database
+
+    Returns None for a streamed response, which is left to the Flask app.
+    """
+    query, response = advance(steps, rows)
+    if query is not None:
+        return Pending(steps, lookup, source, query.statement)
+    if response.is_streamed:
+        return None
+    return cache_store(lookup, response, source is not database)
+
+
+def needs_verification(environ):
+    """Checks if the request carries a token that is not cached, so verifying it may fetch keys
+    """
+    parts = environ.get('HTTP_AUTHORIZATION', '').split()
+    return len(parts) == 2 and parts[1] not in token_cache
+
+
+def fail(error):
+    raise error
+
+
+async def send_response(send, response):
+    headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+               for name, value in response.headers.items()]
+    await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': response.get_data()})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await database.connect()
+            for replica in replicas.members:
+                await replica.connect()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await database.disconnect()
+            for replica in replicas.members:
+                await replica.disconnect()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http' or scope['method'] != 'GET':
+        return await wsgi_app(scope, receive, send)
+
+    environ = build_environ(scope, b'')
+    try:
+        endpoint, kwargs = flask_app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        endpoint = None
+    view = read_views.get(endpoint)
+    if view is None:
+        return await wsgi_app(scope, receive, send)
+
+    # verifying a new token may block on fetching the signing keys
+    if needs_verification(environ):
+        result = await run_in_threadpool(in_request, environ, begin, view, kwargs)
+    else:
+        result = in_request(environ, begin, view, kwargs)
+
+    while isinstance(result, Pending):
+        try:
+            rows = await fetch(result.database, result.statement)
+        except Exception as error:
+            result = in_request(environ, fail, error)
+        else:
+            result = in_request(environ, proceed, result.steps, result.lookup, result.database, rows)
+
+    if result is None:
+        return await wsgi_app(scope, receive, send)
+    await send_response(send, result)
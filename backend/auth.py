@@ -1,14 +1,31 @@
 import os
+import pathlib
 from flask import abort, request
 from urllib.request import urlopen
 import json
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
 from jose import jwt
 from functools import wraps
 
+from timing import timed
+
 
 AUTH0_DOMAIN = os.environ.get('AUTH0_DOMAIN', 'fsnd-ritterjul.eu.auth0.com')
 ALGORITHMS = os.environ.get('ALGORITHMS', ['RS256'])
 API_AUDIENCE = os.environ.get('API_AUDIENCE','swimresults')
+# any URL urlopen understands or a file path, e.g. /path/to/jwks.json for local testing
+JWKS_URL = os.environ.get('JWKS_URL', f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+# seconds the fetched key set is considered fresh
+JWKS_TTL = int(os.environ.get('JWKS_TTL', 600))
+# seconds an expired key set may still be served while it is refreshed
+JWKS_MAX_STALE = int(os.environ.get('JWKS_MAX_STALE', 86400))
+# minimum seconds between refreshes triggered by unknown key ids
+JWKS_REFRESH_COOLDOWN = int(os.environ.get('JWKS_REFRESH_COOLDOWN', 30))
+# number of verified tokens kept in memory, 0 disables the cache
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 1024))
 
 
 class AuthError(Exception):
@@ -19,6 +36,180 @@ class AuthError(Exception):
         self.status_code = status_code
 
 
+class JWKSCache:
+    """In-process cache of the JSON Web Key Set, indexed by key id
+
+    The key set is fetched from `source`, a URL or file path, or given
+    directly as dictionary, e.g. by tests. Keys are fresh for `ttl` seconds.
+    Afterwards they are served stale for up to `max_stale` seconds while a
+    background thread refreshes them. Unknown key ids trigger a synchronous
+    refresh at most once per `refresh_cooldown` seconds, so tokens with
+    made-up key ids cannot cause a refresh storm.
+    """
+    def __init__(self, source, ttl=JWKS_TTL, max_stale=JWKS_MAX_STALE,
+                 refresh_cooldown=JWKS_REFRESH_COOLDOWN, timeout=5):
+        self.source = source
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.refresh_cooldown = refresh_cooldown
+        self.timeout = timeout
+        self.stats = {'hits': 0, 'misses': 0, 'refreshes': 0, 'refresh_errors': 0}
+        self._keys = {}
+        self._fetched_at = None
+        self._attempted_at = None
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+
+    def fetch(self):
+        """Reads the key set and returns it as a dictionary by key id
+        """
+        if isinstance(self.source, dict):
+            jwks = self.source
+        else:
+            url = self.source
+            if '://' not in url:
+                url = pathlib.Path(url).absolute().as_uri()
+            with urlopen(url, timeout=self.timeout) as response:
+                jwks = json.loads(response.read())
+        return {key['kid']: key for key in jwks['keys']}
+
+    def refresh(self):
+        """Replaces the cached key set, keeping the old one if fetching fails
+        """
+        with self._lock:
+            self._attempted_at = time.monotonic()
+        try:
+            keys = self.fetch()
+        except Exception:
+            with self._lock:
+                self.stats['refresh_errors'] += 1
+                has_keys = bool(self._keys)
+            if not has_keys:
+                raise
+            return
+        with self._lock:
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+            self.stats['refreshes'] += 1
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refresh_thread and self._refresh_thread.is_alive():
+                return
+            self._refresh_thread = threading.Thread(target=self.refresh, daemon=True)
+            self._refresh_thread.start()
+
+    def get_key(self, kid):
+        """Returns the JWK with the given key id or None if it is unknown
+
+        The cached fields are read under the lock, refreshing happens outside of it.
+        """
+        now = time.monotonic()
+        with self._lock:
+            fetched_at = self._fetched_at
+        if fetched_at is None or now - fetched_at > self.ttl + self.max_stale:
+            self.refresh()
+        elif now - fetched_at > self.ttl:
+            self._refresh_in_background()
+
+        with self._lock:
+            key = self._keys.get(kid)
+            if key:
+                self.stats['hits'] += 1
+                return key
+            self.stats['misses'] += 1
+            may_refresh = self._attempted_at is None or now - self._attempted_at >= self.refresh_cooldown
+        if not may_refresh:
+            return None
+        self.refresh()
+        with self._lock:
+            return self._keys.get(kid)
+
+
+jwks_cache = JWKSCache(JWKS_URL)
+
+
+VerifiedToken = namedtuple('VerifiedToken', ['payload', 'permissions', 'exp'])
+
+
+class TokenCache:
+    """Bounded LRU cache of verified tokens, keyed by the SHA-256 hash of the token
+
+    Entries are dropped once the token's exp claim has passed, so a cached
+    token is never accepted for longer than the token itself is valid.
+    """
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.stats = {'hits': 0, 'misses': 0}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token):
+        """Returns the VerifiedToken for a token or None if it is not cached
+        """
+        if not self.maxsize:
+            return None
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry.exp <= time.time():
+                del self._entries[key]
+                entry = None
+            if entry:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+            else:
+                self.stats['misses'] += 1
+            return entry
+
+    def __contains__(self, token):
+        """Checks if a token is cached, without counting a hit or miss
+        """
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry is not None and entry.exp > time.time()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def put(self, token, payload):
+        """Stores the decoded payload of a verified token and returns its VerifiedToken
+        """
+        entry = VerifiedToken(
+            payload=payload,
+            permissions=frozenset(payload.get('permissions', ())),
+            exp=payload.get('exp')
+        )
+        if not self.maxsize or entry.exp is None:
+            return entry
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+
+token_cache = TokenCache()
+
+
+def use_key_set(jwks):
+    """Verifies tokens with the given key set instead of the one at JWKS_URL
+
+    For tests and benchmarks with tokens of a local_jwt.LocalIssuer.
+    """
+    global jwks_cache
+    jwks_cache = JWKSCache(jwks)
+    token_cache.clear()
+
+
 def get_token_auth_header():
     """Extracts and returns access token from authorization header
     """
@@ -51,10 +242,13 @@ def get_token_auth_header():
 def verify_decode_jwt(token):
     """Verifies JWT and returns decoded payload
     """
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
-
-    unverified_header = jwt.get_unverified_header(token)
+    try:
+        unverified_header = jwt.get_unverified_header(token)
+    except jwt.JWTError:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Unable to parse token.'
+        }, 401)
 
     if 'kid' not in unverified_header:
         raise AuthError({
@@ -63,15 +257,15 @@ def verify_decode_jwt(token):
         }, 401)
 
     rsa_key = {}
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    key = jwks_cache.get_key(unverified_header['kid'])
+    if key:
+        rsa_key = {
+            'kty': key['kty'],
+            'kid': key['kid'],
+            'use': key['use'],
+            'n': key['n'],
+            'e': key['e']
+        }
 
     if not rsa_key:
         raise AuthError({
@@ -122,16 +316,31 @@ def check_permissions(permission, payload):
         return True
 
 
-def requires_auth(permission=''):
+def authenticate(permission='', *permissions):
+    """Checks the access token of the current request and returns its payload
+
+    Aborts with 401 or 403 if the token is invalid or lacks one of the permissions.
+    """
+    try:
+        with timed('auth'):
+            token = get_token_auth_header()
+            verified = token_cache.get(token)
+            if verified is None:
+                verified = token_cache.put(token, verify_decode_jwt(token))
+            for required in (permission,) + permissions:
+                if required not in verified.permissions:
+                    check_permissions(required, verified.payload)
+            return verified.payload
+    except AuthError as err:
+        abort(err.status_code)
+
+
+def requires_auth(permission='', *permissions):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            try:
-                token = get_token_auth_header()
-                payload = verify_decode_jwt(token)
-                check_permissions(permission, payload)
-                return f(payload, *args, **kwargs)
-            except AuthError as err:
-                abort(err.status_code)
+            return f(authenticate(permission, *permissions), *args, **kwargs)
+        wrapper.permission = permission
+        wrapper.permissions = (permission,) + permissions
         return wrapper
     return requires_auth_decorator
@@ -0,0 +1,56 @@
+"""Compares the per-request cost of requires_auth with the token cache on and off
+
+Runs offline against a locally signed token and a local JWKS file:
+
+    python -m benchmarks.auth_cache --requests 2000
+"""
+import argparse
+import os
+import tempfile
+import time
+from flask import Flask
+
+import auth
+from local_jwt import LocalIssuer
+
+
+def measure(requests, token):
+    app = Flask(__name__)
+
+    @auth.requires_auth('get:swimmers')
+    def endpoint(payload):
+        return payload
+
+    headers = {'Authorization': f'Bearer {token}'}
+    with app.test_request_context(headers=headers):
+        endpoint()
+        start = time.perf_counter()
+        for _ in range(requests):
+            endpoint()
+        return (time.perf_counter() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    issuer = LocalIssuer()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'jwks.json')
+        issuer.write_jwks(path)
+        auth.jwks_cache = auth.JWKSCache(f'file://{path}')
+        token = issuer.mint(['get:swimmers'])
+
+        auth.token_cache = auth.TokenCache(maxsize=0)
+        uncached = measure(args.requests, token)
+        auth.token_cache = auth.TokenCache()
+        cached = measure(args.requests, token)
+
+    print(f'token cache off: {uncached * 1e6:10.1f} us/request')
+    print(f'token cache on:  {cached * 1e6:10.1f} us/request')
+    print(f'speedup:         {uncached / cached:10.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""Generates seeded synthetic swimmers, meets and results and loads them with COPY
+
+    python -m benchmarks.data --scale medium --seed 1
+    python -m benchmarks.data --results 250000
+
+The scales small, medium and large generate 10k, 1M and 10M results.
+
+Loads into the database at DATABASE_URL. The tables must be empty unless
+--truncate is given, which deletes all existing swimmers, meets and results.
+"""
+import argparse
+import csv
+import datetime
+import io
+import os
+import random
+
+
+# (stroke, distance) with their relative frequency at typical meets
+EVENTS = [
+    ('Free', 50, 14), ('Free', 100, 12), ('Free', 200, 8), ('Free', 400, 5),
+    ('Free', 800, 2), ('Free', 1500, 2),
+    ('Back', 50, 7), ('Back', 100, 7), ('Back', 200, 4),
+    ('Breast', 50, 8), ('Breast', 100, 8), ('Breast', 200, 4),
+    ('Fly', 50, 7), ('Fly', 100, 5), ('Fly', 200, 2),
+    ('IM', 100, 3), ('IM', 200, 5), ('IM', 400, 2)
+]
+COURSES = [('SCM', 55), ('LCM', 40), ('SCY', 5)]
+# 100 IM is only swum in short course pools
+SHORT_COURSE_ONLY = {('IM', 100)}
+# approximate seconds per 100 of a fast adult male swimmer in a long course pool
+BASE_PACE = {'Free': 50.0, 'Back': 55.0, 'Breast': 61.0, 'Fly': 53.0, 'IM': 56.0}
+COURSE_FACTOR = {'LCM': 1.0, 'SCM': 0.975, 'SCY': 0.87}
+GENDER_FACTOR = {'M': 1.0, 'F': 1.1, 'X': 1.05}
+
+FIRST_NAMES = ['Anna', 'Ben', 'Clara', 'David', 'Emma', 'Felix', 'Greta', 'Hannes', 'Ida',
+               'Jonas', 'Karla', 'Leon', 'Mia', 'Noah', 'Olivia', 'Paul', 'Romy', 'Simon',
+               'Tilda', 'Ulrich', 'Vera', 'Willi', 'Yara', 'Zoe']
+LAST_NAMES = ['Becker', 'Fischer', 'Hoffmann', 'Koch', 'Meyer', 'Müller', 'Richter', 'Schäfer',
+              'Schmidt', 'Schneider', 'Schulz', 'Wagner', 'Weber', 'Wolf', 'Zimmermann']
+CITIES = [('Berlin', 'Germany'), ('Hamburg', 'Germany'), ('München', 'Germany'),
+          ('Leipzig', 'Germany'), ('Wien', 'Austria'), ('Zürich', 'Switzerland'),
+          ('Amsterdam', 'Netherlands'), ('København', 'Denmark'), ('Budapest', 'Hungary')]
+MEET_KINDS = ['Pokal', 'Cup', 'Meeting', 'Championships', 'Open', 'Trophy']
+FIRST_SEASON = 2000
+LAST_SEASON = 2025
+# number of results of the --scale presets
+SCALES = {'small': 10000, 'medium': 1000000, 'large': 10000000}
+
+
+def _weighted(rng, items):
+    return rng.choices([item[:-1] for item in items], weights=[item[-1] for item in items])[0]
+
+
+def generate_swimmers(count, rng):
+    """Yields (id, gender, first_name, last_name, birth_year, ability) tuples
+
+    Ability is a factor >= 1 on the base pace; most swimmers are age group
+    or masters swimmers well off the base pace.
+    """
+    for swimmer_id in range(1, count + 1):
+        gender = rng.choices(['F', 'M', 'X'], weights=[49, 49, 2])[0]
+        birth_year = int(rng.triangular(1950, 2016, 2006))
+        ability = min(1.05 + rng.lognormvariate(-1.3, 0.5), 2.5)
+        yield (swimmer_id, gender, rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES),
+               birth_year, ability)
+
+
+def generate_meets(count, rng):
+    """Yields (id, name, start_date, end_date, city, country) tuples
+    """
+    first_day = datetime.date(FIRST_SEASON, 1, 1)
+    days = (datetime.date(LAST_SEASON, 12, 31) - first_day).days
+    for meet_id in range(1, count + 1):
+        start_date = first_day + datetime.timedelta(days=rng.randrange(days))
+        end_date = start_date + datetime.timedelta(days=rng.choice([0, 0, 1, 1, 2, 3]))
+        city, country = rng.choice(CITIES)
+        name = f'{meet_id}. {city}er {rng.choice(MEET_KINDS)}'
+        yield (meet_id, name, start_date, end_date, city, country)
+
+
+def swim_time(stroke, distance, course, gender, ability, rng):
+    """Returns a plausible time for a swim in hundredths of a second
+    """
+    seconds = BASE_PACE[stroke] * (distance / 100) ** 1.06
+    seconds *= COURSE_FACTOR[course] * GENDER_FACTOR[gender] * ability
+    seconds *= rng.gauss(1.0, 0.015)
+    return int(seconds * 100)
+
+
+def generate_results(count, swimmers, meet_seasons, rng):
+    """Yields (id, swimmer_id, meet_id, course, distance, stroke, time, season) tuples
+
+    meet_seasons maps the id of every meet to its season.
+    """
+    for result_id in range(1, count + 1):
+        swimmer = rng.choice(swimmers)
+        course = _weighted(rng, COURSES)[0]
+        stroke, distance = _weighted(rng, EVENTS)
+        while course == 'LCM' and (stroke, distance) in SHORT_COURSE_ONLY:
+            stroke, distance = _weighted(rng, EVENTS)
+        time = swim_time(stroke, distance, course, swimmer[1], swimmer[5], rng)
+        meet_id = rng.randint(1, len(meet_seasons))
+        yield (result_id, swimmer[0], meet_id, course, distance, stroke, time, meet_seasons[meet_id])
+
+
+def copy_rows(cursor, table, columns, rows, batch_size=100000):
+    """Loads rows into a table with COPY, one batch at a time
+    """
+    statement = f'COPY {table} ({", ".join(columns)}) FROM STDIN WITH CSV'
+    while True:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        written = 0
+        for row in rows:
+            writer.writerow(row)
+            written += 1
+            if written == batch_size:
+                break
+        if not written:
+            return
+        buffer.seek(0)
+        cursor.copy_expert(statement, buffer)
+
+
+def load(connection, results, seed=1, swimmers=None, meets=None):
+    """Generates and loads a dataset with the given number of results
+    """
+    from models import season_of, season_partition_ddl
+
+    rng = random.Random(seed)
+    swimmers = swimmers or max(1, results // 40)
+    meets = meets or max(1, results // 500)
+
+    swimmer_rows = list(generate_swimmers(swimmers, rng))
+    cursor = connection.cursor()
+    copy_rows(cursor, 'swimmers', ['id', 'gender', 'first_name', 'last_name', 'birth_year'],
+              (row[:5] for row in swimmer_rows))
+    meet_rows = list(generate_meets(meets, rng))
+    copy_rows(cursor, 'meets', ['id', 'name', 'start_date', 'end_date', 'city', 'country'], iter(meet_rows))
+    meet_seasons = {row[0]: season_of(row[2]) for row in meet_rows}
+    for season in sorted(set(meet_seasons.values())):
+        cursor.execute(season_partition_ddl(season))
+    copy_rows(cursor, 'results', ['id', 'swimmer_id', 'meet_id', 'course', 'distance', 'stroke', 'time', 'season'],
+              generate_results(results, swimmer_rows, meet_seasons, rng))
+    for table in ['swimmers', 'meets', 'results']:
+        cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))")
+    connection.commit()
+    cursor.execute('ANALYZE')
+    connection.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', choices=SCALES, default='medium')
+    parser.add_argument('--results', type=int, help='number of results, instead of --scale')
+    parser.add_argument('--swimmers', type=int)
+    parser.add_argument('--meets', type=int)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--truncate', action='store_true')
+    args = parser.parse_args()
+
+    # loading millions of rows takes longer than any request may
+    os.environ.setdefault('DB_STATEMENT_TIMEOUT', '0')
+    from models import db, refresh_leaderboard
+    from app import app
+
+    with app.app_context():
+        connection = db.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            if args.truncate:
+                cursor.execute('TRUNCATE results, meets, swimmers')
+            else:
+                cursor.execute('SELECT EXISTS (SELECT 1 FROM swimmers) OR EXISTS (SELECT 1 FROM meets)')
+                if cursor.fetchone()[0]:
+                    parser.error('database is not empty, use --truncate to replace its data')
+            results = args.results or SCALES[args.scale]
+            load(connection, results, seed=args.seed, swimmers=args.swimmers, meets=args.meets)
+        finally:
+            connection.close()
+        # COPY bypasses the ORM, so the leaderboard is rebuilt in one go
+        with db.engine.begin() as connection:
+            refresh_leaderboard(connection)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Measures throughput and latency of a running server under concurrent load
+
+Start the server with JWKS_URL pointing at the key set written by --jwks,
+once with each entry point, and run the same load against both:
+
+    JWKS_URL=file:///tmp/jwks.json gunicorn app:app -b :8000
+    JWKS_URL=file:///tmp/jwks.json uvicorn asgi:app --port 8001
+    python -m benchmarks.load http://localhost:8000/meets/1/results --jwks /tmp/jwks.json --concurrency 256
+
+Each of the `concurrency` connections sends its next request as soon as
+the previous response arrived. Set RESPONSE_CACHE=off on the server to
+measure the database path rather than the response cache.
+"""
+import argparse
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+from benchmarks.stats import summarize
+
+
+async def read_response(reader):
+    """Reads one HTTP/1.1 response and returns its status code
+    """
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = dict(line.split(': ', 1) for line in lines[1:] if line)
+    headers = {name.lower(): value for name, value in headers.items()}
+
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).strip(), 16)
+            await reader.readexactly(size + 2)
+            if not size:
+                break
+    return status
+
+
+async def client(url, request, deadline, samples, statuses):
+    reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+    try:
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            writer.write(request)
+            status = await read_response(reader)
+            samples.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+async def run(url, token, concurrency, duration):
+    url = urlsplit(url)
+    target = url.path + (f'?{url.query}' if url.query else '')
+    request = (f'GET {target} HTTP/1.1\r\n'
+               f'Host: {url.netloc}\r\n'
+               f'Authorization: Bearer {token}\r\n'
+               f'Accept: application/json\r\n\r\n').encode()
+    samples = []
+    statuses = {}
+    deadline = time.monotonic() + duration
+    start = time.perf_counter()
+    await asyncio.gather(*[client(url, request, deadline, samples, statuses)
+                           for _ in range(concurrency)])
+    return samples, statuses, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('url')
+    parser.add_argument('--token', help='access token, instead of --jwks')
+    parser.add_argument('--jwks', help='write a local key set here and sign a token with it')
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=10)
+    args = parser.parse_args()
+
+    token = args.token
+    if token is None:
+        if args.jwks is None:
+            parser.error('either --token or --jwks is required')
+        from local_jwt import LocalIssuer
+        issuer = LocalIssuer()
+        issuer.write_jwks(args.jwks)
+        token = issuer.mint_role('swimmer')
+
+    samples, statuses, elapsed = asyncio.run(run(args.url, token, args.concurrency, args.duration))
+    stats = summarize(samples)
+    print(f'{args.url}, {args.concurrency} connections: {stats["count"] / elapsed:.0f} requests/s, '
+          f'p50 {stats["p50_ms"]:.2f} ms, p95 {stats["p95_ms"]:.2f} ms, p99 {stats["p99_ms"]:.2f} ms')
+    print('status codes:', ', '.join(f'{status}: {count}' for status, count in sorted(statuses.items())))
+
+
+if __name__ == '__main__':
+    main()
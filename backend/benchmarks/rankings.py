@@ -0,0 +1,78 @@
+"""Measures the personal best and rankings queries on a generated dataset
+
+    python -m benchmarks.data --results 1000000
+    python -m benchmarks.rankings --iterations 200
+
+Prints latency percentiles and the query plans of the queries. The plan of
+season rankings scans the partition of that season only.
+"""
+import argparse
+import random
+import time
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql
+
+from app import app
+from models import db, Swimmer
+from rankings import personal_bests, rankings
+from benchmarks.data import EVENTS, COURSES, FIRST_SEASON, LAST_SEASON
+from benchmarks.stats import summarize
+
+
+def explain(query):
+    statement = query.statement.compile(dialect=postgresql.dialect(),
+                                        compile_kwargs={'literal_binds': True})
+    rows = db.session.execute(f'EXPLAIN (ANALYZE, BUFFERS) {statement}')
+    return '\n'.join(row[0] for row in rows)
+
+
+def measure(iterations, make_query):
+    samples = []
+    for _ in range(iterations):
+        query = make_query()
+        start = time.perf_counter()
+        query.all()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+
+    with app.app_context():
+        results = db.session.execute('SELECT count(*) FROM results').scalar()
+        max_swimmer_id = db.session.query(func.max(Swimmer.id)).scalar()
+
+        def random_personal_bests():
+            return personal_bests(rng.randint(1, max_swimmer_id))
+
+        def random_rankings():
+            stroke, distance, _ = rng.choice(EVENTS)
+            course = rng.choice(COURSES)[0]
+            gender = rng.choice([None, 'F', 'M'])
+            return rankings(stroke, distance, course, gender=gender)
+
+        def random_season_rankings():
+            stroke, distance, _ = rng.choice(EVENTS)
+            course = rng.choice(COURSES)[0]
+            season = rng.randint(FIRST_SEASON, LAST_SEASON)
+            return rankings(stroke, distance, course, season=season)
+
+        print(f'{results} results')
+        for name, make_query in [('personal bests', random_personal_bests),
+                                 ('rankings', random_rankings),
+                                 ('season rankings', random_season_rankings)]:
+            stats = summarize(measure(args.iterations, make_query))
+            print(f'{name}: p50 {stats["p50_ms"]:.2f} ms, p95 {stats["p95_ms"]:.2f} ms, '
+                  f'p99 {stats["p99_ms"]:.2f} ms')
+            print(explain(make_query()))
+            print()
+
+
+if __name__ == '__main__':
+    main()
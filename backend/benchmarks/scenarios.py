@@ -0,0 +1,219 @@
+"""Measures latency and throughput of every route of app.py on a generated dataset
+
+    python -m benchmarks.data --scale medium
+    python -m benchmarks.scenarios --requests 200 --output scenarios.json
+    python -m benchmarks.scenarios --requests 200 --baseline scenarios.json
+
+Requests go through the Flask test client in this process with tokens of a
+local issuer in place of Auth0, so neither a server nor the network is
+needed. The response cache is off unless --cache is given, so the database
+path is measured. Write scenarios create their own swimmers and meets and
+delete them again. --baseline compares p95 latencies with an earlier run.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.data import EVENTS, COURSES, FIRST_SEASON, LAST_SEASON, FIRST_NAMES, LAST_NAMES
+from benchmarks.stats import summarize
+
+
+SERVER_TIMING_DB = re.compile(r'db;dur=([\d.]+);desc="(\d+) statements"')
+
+
+class Scenario:
+    """Requests to one route; url and body are called for each request
+
+    Ids of rows the requests create are appended to `created`.
+    """
+    def __init__(self, name, url, method='GET', body=None, created=None, stream=False):
+        self.name = name
+        self.url = url
+        self.method = method
+        self.body = body or (lambda: None)
+        self.created = created
+        self.stream = stream
+
+
+def scenarios(rng, swimmer_ids, meet_ids):
+    """Returns the scenarios of all routes, writes after the reads they would change
+    """
+    def swimmer():
+        return rng.randint(*swimmer_ids)
+
+    def meet():
+        return rng.randint(*meet_ids)
+
+    def event():
+        stroke, distance = rng.choice(EVENTS)[:2]
+        return f'stroke={stroke}&distance={distance}&course={rng.choice(COURSES)[0]}'
+
+    def name_prefix():
+        # as typed into an autocomplete field
+        name = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+        return name[:rng.randint(3, len(name))].replace(' ', '+')
+
+    def new_swimmer():
+        return {'gender': rng.choice('FM'), 'first name': 'Bench', 'last name': 'Mark',
+                'year of birth': rng.randint(1950, 2016)}
+
+    def new_meet():
+        return {'name': 'Benchmark Meet', 'start date': '01.06.2020', 'end date': '02.06.2020',
+                'city': 'Berlin', 'country': 'Germany'}
+
+    def new_results():
+        return [{'swimmer id': swimmer(), 'course': 'SCM', 'distance': 100, 'stroke': 'Free',
+                 'time': f'1:{rng.randint(0, 59):02d}.{rng.randint(0, 99):02d}'} for _ in range(10)]
+
+    swimmers, meets = [], []
+    return [
+        Scenario('GET /', lambda: '/'),
+        Scenario('GET /swimmers', lambda: '/swimmers?limit=100'),
+        Scenario('GET /swimmers/<id>', lambda: f'/swimmers/{swimmer()}'),
+        Scenario('GET /swimmers/<id>/results', lambda: f'/swimmers/{swimmer()}/results'),
+        Scenario('GET /swimmers/<id>/personal-bests', lambda: f'/swimmers/{swimmer()}/personal-bests'),
+        Scenario('GET /meets', lambda: '/meets?limit=100'),
+        Scenario('GET /meets/<id>', lambda: f'/meets/{meet()}'),
+        Scenario('GET /meets/<id>/results', lambda: f'/meets/{meet()}/results'),
+        Scenario('GET /meets/<id>/results/stream', lambda: f'/meets/{meet()}/results/stream', stream=True),
+        Scenario('GET /results', lambda: f'/results?{event()}&sort=time&limit=100'),
+        # the whole export of an event is read, as a client downloading it would
+        Scenario('GET /export/results (csv)', lambda: f'/export/results?{event()}&format=csv'),
+        Scenario('GET /export/results (parquet)', lambda: f'/export/results?{event()}&format=parquet'),
+        Scenario('GET /export/results (arrow)', lambda: f'/export/results?{event()}&format=arrow'),
+        Scenario('GET /rankings', lambda: f'/rankings?{event()}&season={rng.randint(FIRST_SEASON, LAST_SEASON)}'),
+        Scenario('GET /search', lambda: f'/search?q={name_prefix()}'),
+        Scenario('POST /swimmers', lambda: '/swimmers', 'POST', new_swimmer, created=swimmers),
+        Scenario('PATCH /swimmers/<id>', lambda: f'/swimmers/{rng.choice(swimmers)}', 'PATCH',
+                 lambda: {'year of birth': rng.randint(1950, 2016)}),
+        Scenario('DELETE /swimmers/<id>', lambda: f'/swimmers/{swimmers.pop()}', 'DELETE'),
+        Scenario('POST /meets', lambda: '/meets', 'POST', new_meet, created=meets),
+        Scenario('POST /meets/<id>/results:bulk', lambda: f'/meets/{rng.choice(meets)}/results:bulk',
+                 'POST', new_results),
+        Scenario('PATCH /meets/<id>', lambda: f'/meets/{rng.choice(meets)}', 'PATCH',
+                 lambda: {'city': rng.choice(['Berlin', 'Potsdam'])}),
+        Scenario('DELETE /meets/<id>', lambda: f'/meets/{meets.pop()}', 'DELETE'),
+    ]
+
+
+def send(client, headers, scenario, method, url, body):
+    """Sends one request and returns (seconds, status code, Server-Timing header)
+    """
+    start = time.perf_counter()
+    response = client.open(url, method=method, json=body, headers=headers, buffered=not scenario.stream)
+    if scenario.stream:
+        # the stream never ends, its first chunk holds the snapshot of the meet
+        next(iter(response.response))
+    elapsed = time.perf_counter() - start
+    response.close()
+    if scenario.created is not None and response.status_code == 200:
+        scenario.created.append(response.get_json()['id'])
+    return elapsed, response.status_code, response.headers.get('Server-Timing', '')
+
+
+def run(client, headers, scenario, requests, concurrency):
+    """Runs the requests of a scenario and returns their statistics
+    """
+    # built up front in one thread, so the same seed gives the same requests
+    calls = [(scenario.method, scenario.url(), scenario.body()) for _ in range(requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        responses = list(executor.map(lambda call: send(client, headers, scenario, *call), calls))
+    elapsed = time.perf_counter() - start
+
+    stats = summarize([seconds for seconds, _, _ in responses])
+    stats['requests_per_s'] = len(responses) / elapsed
+    stats['errors'] = sum(status >= 400 for _, status, _ in responses)
+    timings = [SERVER_TIMING_DB.search(header) for _, _, header in responses]
+    timings = [match for match in timings if match]
+    if timings:
+        stats['db_ms'] = sum(float(match.group(1)) for match in timings) / len(timings)
+        stats['statements'] = sum(int(match.group(2)) for match in timings) / len(timings)
+    return stats
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--cache', action='store_true', help='keep the response cache on')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON file of an earlier run to compare with')
+    args = parser.parse_args()
+
+    # auth.py and cache.py read their configuration on import
+    jwks_path = os.path.join(tempfile.mkdtemp(), 'jwks.json')
+    os.environ['JWKS_URL'] = f'file://{jwks_path}'
+    if not args.cache:
+        os.environ['RESPONSE_CACHE'] = 'off'
+    from local_jwt import LocalIssuer
+    issuer = LocalIssuer()
+    issuer.write_jwks(jwks_path)
+    from sqlalchemy import func
+    from app import app
+    from models import db, Swimmer, Meet, Result
+
+    permissions = {permission for view in app.view_functions.values()
+                   for permission in getattr(view, 'permissions', ())} - {''}
+    headers = {'Authorization': f'Bearer {issuer.mint(permissions)}'}
+    client = app.test_client()
+    rng = random.Random(args.seed)
+
+    with app.app_context():
+        dataset = {
+            'swimmers': db.session.query(func.count(Swimmer.id)).scalar(),
+            'meets': db.session.query(func.count(Meet.id)).scalar(),
+            'results': db.session.query(func.count(Result.id)).scalar()
+        }
+        swimmer_ids = db.session.query(func.min(Swimmer.id), func.max(Swimmer.id)).one()
+        meet_ids = db.session.query(func.min(Meet.id), func.max(Meet.id)).one()
+    if not dataset['swimmers'] or not dataset['meets']:
+        parser.error('database is empty, generate data with benchmarks.data first')
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['scenarios']
+
+    report = {
+        'commit': git_commit(),
+        'dataset': dataset,
+        'settings': {'requests': args.requests, 'concurrency': args.concurrency,
+                     'seed': args.seed, 'cache': args.cache},
+        'scenarios': {}
+    }
+    print(f'{dataset["results"]} results, {args.requests} requests per route, '
+          f'concurrency {args.concurrency}')
+    for scenario in scenarios(rng, swimmer_ids, meet_ids):
+        stats = run(client, headers, scenario, args.requests, args.concurrency)
+        report['scenarios'][scenario.name] = stats
+        line = (f'{scenario.name:40} {stats["requests_per_s"]:8.0f} requests/s  p50 {stats["p50_ms"]:7.2f} ms  '
+                f'p95 {stats["p95_ms"]:7.2f} ms  p99 {stats["p99_ms"]:7.2f} ms')
+        if stats['errors']:
+            line += f'  {stats["errors"]} errors'
+        if scenario.name in baseline:
+            line += f'  p95 {stats["p95_ms"] / baseline[scenario.name]["p95_ms"] - 1:+.0%}'
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Measures GET /search queries on a generated dataset
+
+    python -m benchmarks.data --scale large
+    python -m benchmarks.search --iterations 200
+
+Search terms are prefixes of generated names as typed during autocomplete,
+some with a letter dropped. Prints latency percentiles and the query plans
+of both queries, which should use the trigram indexes.
+"""
+import argparse
+import random
+
+from app import app
+from models import db, Swimmer, Meet, SWIMMER_SEARCH_TEXT, MEET_SEARCH_TEXT
+from search import search, SEARCH_LIMIT
+from serializers import SWIMMER_COLUMNS, MEET_COLUMNS
+from benchmarks.data import FIRST_NAMES, LAST_NAMES, CITIES, MEET_KINDS
+from benchmarks.rankings import measure
+from benchmarks.stats import summarize
+
+
+def explain(query):
+    # run with psycopg2's own parameters, rendering them as literals would double the % of <%
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    cursor = db.session.connection().connection.cursor()
+    cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS) {compiled}', compiled.params)
+    return '\n'.join(row[0] for row in cursor.fetchall())
+
+
+def random_term(rng, words):
+    """Returns a prefix of one or two of the words, with a letter dropped in every fourth term
+    """
+    term = ' '.join(rng.sample(words, rng.choice([1, 2]))).lower()
+    term = term[:rng.randint(min(3, len(term)), len(term))]
+    if len(term) > 3 and rng.random() < 0.25:
+        index = rng.randrange(1, len(term))
+        term = term[:index] + term[index + 1:]
+    return term
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    meet_words = [city for city, _ in CITIES] + MEET_KINDS
+
+    with app.app_context():
+        swimmers = db.session.execute('SELECT count(*) FROM swimmers').scalar()
+        meets = db.session.execute('SELECT count(*) FROM meets').scalar()
+
+        def search_swimmers():
+            term = random_term(rng, FIRST_NAMES + LAST_NAMES)
+            return search(db.session.query(*SWIMMER_COLUMNS), SWIMMER_SEARCH_TEXT, Swimmer.id, term, SEARCH_LIMIT)
+
+        def search_meets():
+            term = random_term(rng, meet_words)
+            return search(db.session.query(*MEET_COLUMNS), MEET_SEARCH_TEXT, Meet.id, term, SEARCH_LIMIT)
+
+        print(f'{swimmers} swimmers, {meets} meets')
+        for name, make_query in [('swimmers', search_swimmers), ('meets', search_meets)]:
+            stats = summarize(measure(args.iterations, make_query))
+            print(f'{name}: p50 {stats["p50_ms"]:.2f} ms, p95 {stats["p95_ms"]:.2f} ms, '
+                  f'p99 {stats["p99_ms"]:.2f} ms')
+            print(explain(make_query()))
+            print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Compares rows per second of ORM format() + jsonify with the column serializers
+
+Runs offline on synthetic rows, no database needed:
+
+    python -m benchmarks.serialization --rows 100000
+
+Also checks that both paths produce the same bytes.
+"""
+import argparse
+import os
+import random
+import time
+from collections import namedtuple
+
+# the benchmark never connects, but models needs a database URL to import
+os.environ.setdefault('DATABASE_URL', 'postgresql://localhost/swimresults')
+
+from flask import Flask, jsonify
+
+from models import Swimmer, Meet, Result
+from serializers import (SWIMMER_COLUMNS, MEET_COLUMNS, RESULT_COLUMNS,
+                         format_swimmer, format_meet, format_result, json_response)
+from benchmarks.data import generate_swimmers, generate_meets, generate_results, FIRST_SEASON
+
+
+def rows_per_second(rows, serialize):
+    start = time.perf_counter()
+    serialize(rows)
+    return len(rows) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    swimmers = list(generate_swimmers(max(1, args.rows // 40), rng))
+    meet_seasons = dict.fromkeys(range(1, 101), FIRST_SEASON)
+    datasets = {
+        'swimmers': (Swimmer, SWIMMER_COLUMNS, format_swimmer, [row[:5] for row in swimmers]),
+        'meets': (Meet, MEET_COLUMNS, format_meet, list(generate_meets(args.rows, rng))),
+        'results': (Result, RESULT_COLUMNS, format_result,
+                    [row[:7] for row in generate_results(args.rows, swimmers, meet_seasons, rng)])
+    }
+
+    app = Flask(__name__)
+    with app.app_context():
+        for name, (model, columns, format_row, values) in datasets.items():
+            names = [column.key for column in columns]
+            Row = namedtuple('Row', names)
+            rows = [Row(*row) for row in values]
+            objects = [model(**dict(zip(names, row))) for row in values]
+
+            def orm_path(objects):
+                return jsonify({'success': True, name: [obj.format() for obj in objects]}).get_data()
+
+            def column_path(rows):
+                return json_response({'success': True, name: [format_row(row) for row in rows]}).get_data()
+
+            if orm_path(objects) != column_path(rows):
+                raise SystemExit(f'{name}: output differs')
+
+            before = rows_per_second(objects, orm_path)
+            after = rows_per_second(rows, column_path)
+            print(f'{name:8}  format() + jsonify: {before:10.0f} rows/s   '
+                  f'serializers: {after:10.0f} rows/s   ({after / before:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
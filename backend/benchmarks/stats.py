@@ -0,0 +1,18 @@
+def percentile(samples, fraction):
+    """Returns the nearest-rank percentile of a list of samples
+    """
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(samples):
+    """Returns count, mean and p50/p95/p99 of latencies in seconds, in milliseconds
+    """
+    return {
+        'count': len(samples),
+        'mean_ms': sum(samples) / len(samples) * 1000,
+        'p50_ms': percentile(samples, 0.50) * 1000,
+        'p95_ms': percentile(samples, 0.95) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000
+    }
@@ -0,0 +1,350 @@
+import os
+import datetime
+import hashlib
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from itertools import chain
+from flask import current_app, g, request
+from sqlalchemy import event, inspect
+
+from models import db, Swimmer, Meet, Result, DB_REPLICA_PIN_SECONDS
+from compression import negotiate, compress, compressible, mark_encoded
+
+
+# memory (in-process LRU, per worker), redis (shared by all workers) or off
+RESPONSE_CACHE = os.environ.get('RESPONSE_CACHE', 'memory')
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 1024))
+# seconds a cached response is kept at most, bounds memory of unused entries
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 3600))
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+
+
+class LRUBackend:
+    """In-process cache storage with LRU eviction, shared by the threads of one worker
+    """
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def get_many(self, keys):
+        with self._lock:
+            return [self._get(key) for key in keys]
+
+    def _set(self, key, value, ttl=None):
+        expires = time.monotonic() + ttl if ttl else None
+        self._entries[key] = (value, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._set(key, value, ttl)
+
+    def setdefault(self, key, value):
+        with self._lock:
+            current = self._get(key)
+            if current is not None:
+                return current
+            self._set(key, value)
+            return value
+
+
+class RedisBackend:
+    """Cache storage shared by all workers, backed by Redis or a client with the same interface
+    """
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url):
+        import redis
+        return cls(redis.Redis.from_url(url))
+
+    def get_many(self, keys):
+        return self.client.mget(keys)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, ex=ttl)
+
+    def setdefault(self, key, value):
+        if self.client.set(key, value, nx=True):
+            return value
+        return self.client.get(key)
+
+
+class ResponseCache:
+    """Caches response bodies per route, request arguments and tag versions
+
+    Every cached route depends on tags such as 'meets' or 'meet:1'. Each tag
+    has a version token, and the cache key of a response includes the
+    versions of its tags. Invalidating a tag replaces its token, so every
+    response depending on it misses from then on and ages out of the backend.
+    Tokens are random, so a version that is evicted or lost restarts at a
+    value no old entry was stored under.
+    """
+    def __init__(self, backend, ttl=RESPONSE_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    @staticmethod
+    def new_version():
+        return f'{int(time.time() * 1000):x}.{secrets.token_hex(4)}'.encode()
+
+    def versions(self, tags):
+        """Returns the current version token of every tag
+        """
+        keys = [f'v:{tag}' for tag in tags]
+        versions = self.backend.get_many(keys)
+        return [version if version is not None else self.backend.setdefault(key, self.new_version())
+                for key, version in zip(keys, versions)]
+
+    def lookup(self, tags):
+        """Returns the cache key, the last modification time and the time of the last change
+
+        The key changes whenever one of the tags is invalidated, so it doubles
+        as strong ETag. The time of the last change is the creation time of
+        the newest tag version, in seconds since the epoch. The modification
+        time is that time truncated to seconds as in Last-Modified. It is
+        None while that version is less than a second old, as a change later
+        in the same second would otherwise not move it.
+        """
+        versions = [version.decode() if isinstance(version, bytes) else version
+                    for version in self.versions(tags)]
+        parts = [request.path, request.headers.get('Accept', '')]
+        parts.extend(f'{name}={value}' for name, value in sorted(request.args.items(multi=True)))
+        parts.extend(versions)
+        key = 'r:' + hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+
+        created = max((int(version.partition('.')[0], 16) / 1000 for version in versions), default=0)
+        if time.time() - created < 1:
+            return key, None, created
+        return key, datetime.datetime.utcfromtimestamp(int(created)), created
+
+    def key(self, tags):
+        """Returns the cache key of the current request depending on the given tags
+        """
+        return self.lookup(tags)[0]
+
+    def get(self, key):
+        """Returns the (body, mimetype) stored under key or None
+        """
+        entry = self.get_encoded(key)
+        return entry[:2] if entry is not None else None
+
+    def get_encoded(self, key, encoding=None):
+        """Returns the (body, mimetype, encoding) stored under key or None
+
+        The body compressed with the given encoding is preferred, if there is
+        none the uncompressed body is returned with encoding None. Both are
+        fetched in one round trip.
+        """
+        encodings = [encoding, None] if encoding is not None else [None]
+        keys = [f'{key}:{stored}' if stored is not None else key for stored in encodings]
+        for entry, stored in zip(self.backend.get_many(keys), encodings):
+            if entry is not None:
+                self.stats['hits'] += 1
+                mimetype, _, body = entry.partition(b'\n')
+                return body, mimetype.decode(), stored
+        self.stats['misses'] += 1
+        return None
+
+    def set(self, key, body, mimetype, encoding=None):
+        if encoding is not None:
+            key = f'{key}:{encoding}'
+        self.backend.set(key, mimetype.encode() + b'\n' + body, ttl=self.ttl)
+
+    def invalidate(self, tags):
+        for tag in tags:
+            self.backend.set(f'v:{tag}', self.new_version())
+        self.stats['invalidations'] += len(tags)
+
+
+response_cache = None
+
+
+def _not_modified(etag, last_modified):
+    """Checks the conditional headers of the current request
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    return last_modified is not None and request.if_modified_since is not None \
+        and last_modified <= request.if_modified_since
+
+
+def _set_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
+
+
+def cache_lookup(tags):
+    """Looks up the response of the current request depending on the given tags
+
+    Returns the lookup, to pass on to cache_store, and the response if the
+    request is answered from the cache, either with 304 or a cached body.
+    The lookup is None while the cache is disabled.
+    """
+    if response_cache is None:
+        return None, None
+
+    key, last_modified, changed = response_cache.lookup(tags)
+    lookup = (key, key[2:], last_modified, changed)
+    if _not_modified(key[2:], last_modified):
+        return lookup, _set_validators(current_app.response_class(status=304), key[2:], last_modified)
+
+    entry = response_cache.get_encoded(key, negotiate())
+    if entry is not None:
+        body, mimetype, encoding = entry
+        response = _set_validators(current_app.response_class(body, mimetype=mimetype), key[2:], last_modified)
+        if encoding is not None:
+            return lookup, mark_encoded(response, encoding)
+        return lookup, _compress_cached(key, response, body)
+    return lookup, None
+
+
+def _compress_cached(key, response, body):
+    """Compresses a cached response for the current request and caches the compressed body as well
+    """
+    encoding = negotiate(len(body)) if compressible(response) else None
+    if encoding is None:
+        return response
+    body = compress(body, encoding)
+    response_cache.set(key, body, response.mimetype, encoding)
+    response.set_data(body)
+    return mark_encoded(response, encoding)
+
+
+def cache_store(lookup, response, from_replica=False):
+    """Stores a response computed after cache_lookup found none and sets its validators
+
+    A response read from a replica within DB_REPLICA_PIN_SECONDS of the last
+    change of its tags is passed on like with the cache disabled. The replica
+    may lag behind that change, and its body must not be kept or validated
+    under the new tag versions.
+    """
+    if response.status_code != 200:
+        return response
+
+    if lookup is None or from_replica and time.time() - lookup[3] < DB_REPLICA_PIN_SECONDS:
+        if not response.is_streamed:
+            response.add_etag()
+            response.make_conditional(request)
+        return response
+
+    key, etag, last_modified, _ = lookup
+    _set_validators(response, etag, last_modified)
+    if not response.is_streamed:
+        body = response.get_data()
+        response_cache.set(key, body, response.mimetype)
+        response = _compress_cached(key, response, body)
+    return response
+
+
+def cached(*tags):
+    """Serves a route from the response cache and answers conditional requests
+
+    Tags may refer to view arguments, e.g. 'meet:{meet_id}'. Apply below
+    requires_auth, so permissions are checked before a cached body is
+    served. Only complete 200 responses are stored, and along with them
+    the compressed bodies sent to clients that accept an encoding.
+
+    Responses carry an ETag and Last-Modified derived from the tag
+    versions, so If-None-Match and If-Modified-Since are answered with 304
+    before the view runs. With the cache disabled the ETag is a hash of the
+    body and the view always runs.
+    """
+    def cached_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            lookup, response = cache_lookup([tag.format(**kwargs) for tag in tags])
+            if response is not None:
+                return response
+            return cache_store(lookup, f(*args, **kwargs), g.get('read_replica', False))
+        wrapper.cache_tags = tags
+        return wrapper
+    return cached_decorator
+
+
+def invalidate(tags):
+    """Invalidates all cached responses depending on any of the tags
+    """
+    if response_cache is not None:
+        response_cache.invalidate(tags)
+
+
+def result_tags(swimmer_id, meet_id):
+    return ['results', f'results:swimmer:{swimmer_id}', f'results:meet:{meet_id}']
+
+
+def _changed_tags(obj):
+    """Returns the tags of the data an object that was inserted, updated or deleted belongs to
+    """
+    if isinstance(obj, Swimmer):
+        return ['swimmers', f'swimmer:{obj.id}']
+    if isinstance(obj, Meet):
+        return ['meets', f'meet:{obj.id}']
+    if isinstance(obj, Result):
+        tags = result_tags(obj.swimmer_id, obj.meet_id)
+        # an edit that moves a result also changes its old swimmer and meet
+        for name in ('swimmer_id', 'meet_id'):
+            previous = inspect(obj).attrs[name].history.deleted
+            if previous:
+                tags.append(f'results:{name[:-3]}:{previous[0]}')
+        return tags
+    return []
+
+
+def _collect_tags(session, flush_context):
+    tags = session.info.setdefault('cache_tags', set())
+    for obj in chain(session.new, session.dirty, session.deleted):
+        tags.update(_changed_tags(obj))
+
+
+def _invalidate_tags(session):
+    tags = session.info.pop('cache_tags', None)
+    if tags:
+        invalidate(sorted(tags))
+
+
+def _discard_tags(session):
+    session.info.pop('cache_tags', None)
+
+
+def setup_cache(app, backend=RESPONSE_CACHE):
+    """Configures the response cache and invalidates it on every commit that changes data
+
+    Writes that bypass the ORM must call invalidate themselves.
+    """
+    global response_cache
+
+    if backend == 'memory':
+        response_cache = ResponseCache(LRUBackend())
+    elif backend == 'redis':
+        response_cache = ResponseCache(RedisBackend.from_url(REDIS_URL))
+    elif isinstance(backend, (LRUBackend, RedisBackend)):
+        response_cache = ResponseCache(backend)
+    else:
+        response_cache = None
+
+    if not event.contains(db.session, 'after_flush', _collect_tags):
+        event.listen(db.session, 'after_flush', _collect_tags)
+        event.listen(db.session, 'after_commit', _invalidate_tags)
+        event.listen(db.session, 'after_rollback', _discard_tags)
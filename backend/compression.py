@@ -0,0 +1,155 @@
+import os
+import gzip
+import zlib
+from flask import request
+
+from streaming import NDJSON_MIMETYPE
+from timing import timed
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# encodings offered in order of preference, br needs the brotli and zstd the zstandard package, empty turns compression off
+COMPRESSION_ENCODINGS = [encoding.strip() for encoding in os.environ.get('COMPRESSION_ENCODINGS', 'zstd,br,gzip').split(',')
+                         if encoding.strip()]
+# bytes a response body needs at least to be compressed, smaller ones hardly shrink
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSIBLE_MIMETYPES = ('application/json', NDJSON_MIMETYPE, 'text/csv')
+# levels that favour speed, responses are compressed while the client waits
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 3
+
+# brotli and zstandard are optional, they are not in requirements.txt
+INSTALLED = {'gzip': True, 'br': brotli is not None, 'zstd': zstandard is not None}
+
+
+def available(encodings, installed=INSTALLED):
+    """Returns the encodings whose package is installed, in the given order of preference
+    """
+    return [encoding for encoding in encodings if installed.get(encoding)]
+
+
+ENCODINGS = available(COMPRESSION_ENCODINGS)
+
+
+def _gzip_stream():
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return lambda data: compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+def _brotli_stream():
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    return lambda data: compressor.process(data) + compressor.flush(), compressor.finish
+
+
+def _zstd_stream():
+    compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    return (lambda data: compressor.compress(data) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK),
+            compressor.flush)
+
+
+COMPRESSORS = {
+    'gzip': lambda data: gzip.compress(data, GZIP_LEVEL, mtime=0),
+    'br': lambda data: brotli.compress(data, quality=BROTLI_QUALITY),
+    'zstd': lambda data: zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+}
+STREAM_COMPRESSORS = {'gzip': _gzip_stream, 'br': _brotli_stream, 'zstd': _zstd_stream}
+
+
+def negotiate(size=None):
+    """Returns the encoding the client of the current request accepts best or None
+
+    Of encodings the client accepts equally, the first of ENCODINGS is
+    chosen. Bodies of a known size below COMPRESSION_MIN_SIZE are not
+    compressed.
+    """
+    if not ENCODINGS or (size is not None and size < COMPRESSION_MIN_SIZE):
+        return None
+    return request.accept_encodings.best_match(ENCODINGS)
+
+
+def compressible(response):
+    return response.mimetype in COMPRESSIBLE_MIMETYPES
+
+
+def compress(data, encoding):
+    with timed('serialize'):
+        return COMPRESSORS[encoding](data)
+
+
+def compress_chunks(chunks, encoding, charset='utf-8'):
+    """Compresses a streamed body, flushed after every chunk so clients can decode each one on arrival
+    """
+    compress_chunk, finish = STREAM_COMPRESSORS[encoding]()
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode(charset)
+            data = compress_chunk(chunk)
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def mark_encoded(response, encoding):
+    """Sets the headers of a response whose body is compressed with encoding
+
+    A strong ETag becomes weak, as it names the uncompressed body.
+    """
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def _compress_response(response):
+    if response.status_code == 304:
+        # keeps the ETag in the form the client has stored it, i.e. weak for a compressed body
+        etag, weak = response.get_etag()
+        if etag is not None and not weak and request.if_none_match.is_weak(etag):
+            response.set_etag(etag, weak=True)
+        return response
+    if not compressible(response) or 'Content-Encoding' in response.headers or response.direct_passthrough:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    if response.is_streamed:
+        encoding = negotiate()
+        if encoding is not None:
+            response.response = compress_chunks(response.response, encoding, response.charset)
+            response.headers.pop('Content-Length', None)
+            mark_encoded(response, encoding)
+        return response
+
+    body = response.get_data()
+    encoding = negotiate(len(body))
+    if encoding is not None:
+        response.set_data(compress(body, encoding))
+        mark_encoded(response, encoding)
+    return response
+
+
+def setup_compression(app):
+    """Compresses JSON, NDJSON and CSV responses with the encoding negotiated by Accept-Encoding
+
+    Streamed responses are compressed chunk by chunk. The response cache
+    compresses the responses it serves itself and keeps the compressed
+    bodies, so cache hits are not compressed again. Server-sent events are
+    left uncompressed, proxies would buffer them. Call after setup_timing,
+    so compressing counts as serialization time.
+    """
+    if _compress_response not in app.after_request_funcs.get(None, []):
+        app.after_request(_compress_response)
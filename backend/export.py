@@ -0,0 +1,196 @@
+import os
+import queue
+import threading
+from itertools import islice
+from flask import Response, stream_with_context
+
+from models import db, Result
+from filters import STROKES, COURSES
+
+
+EXPORT_FORMATS = ('csv', 'parquet', 'arrow')
+# rows per Arrow record batch and Parquet row group, fetched per round trip from the server-side cursor
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 65536))
+# chunks COPY may write ahead of the client before it waits
+EXPORT_QUEUE_SIZE = 16
+
+MIMETYPES = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.stream'
+}
+EXTENSIONS = {'csv': 'csv', 'parquet': 'parquet', 'arrow': 'arrows'}
+
+EXPORT_COLUMNS = (
+    Result.id, Result.swimmer_id, Result.meet_id, Result.course, Result.distance, Result.stroke,
+    # the time as a duration in milliseconds, a unit analytics tools know, unlike hundredths
+    (Result.time * 10).label('time_ms')
+)
+
+
+def _lift_statement_timeout():
+    """Lifts DB_STATEMENT_TIMEOUT for the rest of the transaction, an export of all results takes longer
+    """
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        connection.execute('SET LOCAL statement_timeout = 0')
+    return connection
+
+
+class _QueueWriter:
+    """File object COPY writes to, whose chunks are sent by the thread of the response
+    """
+    def __init__(self, chunks):
+        self.write = chunks.put
+
+
+def _copy(cursor, sql, chunks):
+    try:
+        cursor.copy_expert(sql, _QueueWriter(chunks))
+        chunks.put(None)
+    except Exception as error:
+        chunks.put(error)
+
+
+def copy_csv(query):
+    """Streams the rows of a query as CSV with a header line, written by Postgres with COPY TO STDOUT
+
+    COPY runs in a thread and hands its output over in chunks, at most
+    EXPORT_QUEUE_SIZE ahead of the client. If the client goes away, the
+    COPY is cancelled.
+    """
+    connection = _lift_statement_timeout()
+    compiled = query.statement.compile(dialect=connection.dialect)
+    dbapi_connection = connection.connection
+    cursor = dbapi_connection.cursor()
+    select = cursor.mogrify(str(compiled), compiled.params).decode()
+    sql = f'COPY ({select}) TO STDOUT WITH (FORMAT csv, HEADER)'
+
+    chunks = queue.Queue(EXPORT_QUEUE_SIZE)
+    thread = threading.Thread(target=_copy, args=(cursor, sql, chunks), daemon=True)
+    thread.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        if thread.is_alive():
+            dbapi_connection.cancel()
+            while thread.is_alive():
+                try:
+                    chunks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+        thread.join()
+        cursor.close()
+
+
+def export_schema(pa):
+    enum = pa.dictionary(pa.int8(), pa.string())
+    return pa.schema([
+        pa.field('id', pa.int32(), nullable=False),
+        pa.field('swimmer_id', pa.int32(), nullable=False),
+        pa.field('meet_id', pa.int32(), nullable=False),
+        pa.field('course', enum, nullable=False),
+        pa.field('distance', pa.int16(), nullable=False),
+        pa.field('stroke', enum, nullable=False),
+        pa.field('time', pa.duration('ms'), nullable=False)
+    ])
+
+
+def record_batches(pa, schema, rows):
+    """Turns rows of EXPORT_COLUMNS into record batches of EXPORT_BATCH_SIZE rows
+
+    Course and stroke are dictionary encoded with the values of their
+    enum as dictionary, the same in every batch.
+    """
+    def encode(values, choices, dictionary):
+        indices = {choice: index for index, choice in enumerate(choices)}
+        return pa.DictionaryArray.from_arrays(pa.array([indices[value] for value in values], pa.int8()), dictionary)
+
+    courses, strokes = pa.array(COURSES), pa.array(STROKES)
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, EXPORT_BATCH_SIZE))
+        if not batch:
+            return
+        ids, swimmer_ids, meet_ids, course, distance, stroke, time = zip(*batch)
+        yield pa.record_batch([
+            pa.array(ids, pa.int32()),
+            pa.array(swimmer_ids, pa.int32()),
+            pa.array(meet_ids, pa.int32()),
+            encode(course, COURSES, courses),
+            pa.array(distance, pa.int16()),
+            encode(stroke, STROKES, strokes),
+            pa.array(time, pa.duration('ms'))
+        ], schema=schema)
+
+
+class _Chunks:
+    """Output stream that collects what a writer wrote since it was last taken
+    """
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def arrow_chunks(query, export_format):
+    """Streams the rows of a query as Parquet file or Arrow IPC stream, one record batch at a time
+
+    Rows are read from a server-side cursor, so memory use depends on
+    EXPORT_BATCH_SIZE only. Each batch of a Parquet file is a row group.
+    """
+    import pyarrow as pa
+
+    _lift_statement_timeout()
+    schema = export_schema(pa)
+    sink = _Chunks()
+    if export_format == 'parquet':
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema)
+        write = lambda batch: writer.write_table(pa.Table.from_batches([batch]))
+    else:
+        writer = pa.ipc.new_stream(pa.PythonFile(sink, mode='w'), schema)
+        write = writer.write_batch
+
+    for batch in record_batches(pa, schema, query.yield_per(EXPORT_BATCH_SIZE)):
+        write(batch)
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+def export_response(query, export_format):
+    """Streams all rows of a query of EXPORT_COLUMNS as a file download in one of EXPORT_FORMATS
+    """
+    if export_format == 'csv':
+        chunks = copy_csv(query)
+    else:
+        chunks = arrow_chunks(query, export_format)
+    response = Response(stream_with_context(chunks), mimetype=MIMETYPES[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename=results.{EXTENSIONS[export_format]}'
+    return response
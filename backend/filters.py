@@ -0,0 +1,148 @@
+import os
+import datetime
+from flask import request, abort
+from sqlalchemy import any_, literal
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from models import parse_time, season_of, Swimmer, Meet, Result
+
+
+# ids a batch lookup with ?ids= may ask for at once
+MAX_BATCH_IDS = int(os.environ.get('MAX_BATCH_IDS', 100))
+
+
+STROKES = Result.stroke.type.enums
+COURSES = Result.course.type.enums
+GENDERS = Swimmer.gender.type.enums
+SORT_ORDERS = {
+    'id': (Result.id,),
+    'time': (Result.time, Result.id)
+}
+
+
+def get_int_arg(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        abort(400)
+
+
+def get_date_arg(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return datetime.datetime.strptime(value, "%d.%m.%Y").date()
+    except ValueError:
+        abort(400)
+
+
+def get_time_arg(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return parse_time(value)
+    except ValueError:
+        abort(400)
+
+
+def get_choice_arg(name, choices):
+    value = request.args.get(name)
+    if value is not None and value not in choices:
+        abort(400)
+    return value
+
+
+def get_ids_arg(name='ids'):
+    """Returns the comma separated ids of a batch lookup in the requested order, without duplicates
+
+    Aborts with 400 if an id is invalid or more than MAX_BATCH_IDS are requested.
+    """
+    value = request.args.get(name)
+    if value is None:
+        return None
+    parts = value.split(',')
+    if len(parts) > MAX_BATCH_IDS:
+        abort(400)
+    try:
+        return list(dict.fromkeys(int(part) for part in parts))
+    except ValueError:
+        abort(400)
+
+
+def lookup_ids(query, column, ids):
+    """Fetches the rows with the given ids in one query, for read views
+
+        rows, missing = yield from lookup_ids(query, Swimmer.id, ids)
+
+    The ids are sent as one array parameter of `column = ANY(...)`. Returns
+    the rows in the order of ids and the ids that do not exist.
+    """
+    rows = yield query.filter(column == any_(literal(ids, ARRAY(column.type))))
+    found = {row.id: row for row in rows}
+    return [found[key] for key in ids if key in found], [key for key in ids if key not in found]
+
+
+def filter_results(query):
+    """Applies the filters given as request arguments to a query of results
+
+    Returns the filtered query and the columns it has to be ordered by.
+    Aborts with 400 if an argument is invalid.
+    """
+    swimmer_id = get_int_arg('swimmer_id')
+    meet_id = get_int_arg('meet_id')
+    stroke = get_choice_arg('stroke', STROKES)
+    distance = get_int_arg('distance')
+    course = get_choice_arg('course', COURSES)
+    gender = get_choice_arg('gender', GENDERS)
+    birth_year_from = get_int_arg('birth_year_from')
+    birth_year_to = get_int_arg('birth_year_to')
+    season = get_int_arg('season')
+    date_from = get_date_arg('date_from')
+    date_to = get_date_arg('date_to')
+    time_from = get_time_arg('time_from')
+    time_to = get_time_arg('time_to')
+    order = SORT_ORDERS.get(request.args.get('sort', 'id'))
+
+    if order is None:
+        abort(400)
+
+    if swimmer_id is not None:
+        query = query.filter(Result.swimmer_id == swimmer_id)
+    if meet_id is not None:
+        query = query.filter(Result.meet_id == meet_id)
+    if stroke is not None:
+        query = query.filter(Result.stroke == stroke)
+    if distance is not None:
+        query = query.filter(Result.distance == distance)
+    if course is not None:
+        query = query.filter(Result.course == course)
+    if season is not None:
+        query = query.filter(Result.season == season)
+    if time_from is not None:
+        query = query.filter(Result.time >= time_from)
+    if time_to is not None:
+        query = query.filter(Result.time <= time_to)
+
+    if gender is not None or birth_year_from is not None or birth_year_to is not None:
+        query = query.join(Swimmer, Result.swimmer_id == Swimmer.id)
+        if gender is not None:
+            query = query.filter(Swimmer.gender == gender)
+        if birth_year_from is not None:
+            query = query.filter(Swimmer.birth_year >= birth_year_from)
+        if birth_year_to is not None:
+            query = query.filter(Swimmer.birth_year <= birth_year_to)
+
+    if date_from is not None or date_to is not None:
+        # the seasons of the dates bound the partitions of results to scan
+        query = query.join(Meet, Result.meet_id == Meet.id)
+        if date_from is not None:
+            query = query.filter(Meet.start_date >= date_from, Result.season >= season_of(date_from))
+        if date_to is not None:
+            query = query.filter(Meet.start_date <= date_to, Result.season <= season_of(date_to))
+
+    return query, order
@@ -0,0 +1,45 @@
+"""Configuration of gunicorn, which loads this file from the working directory
+
+Threaded workers, so open result streams and requests waiting for the
+database do not block a whole worker. models.py sizes the connection pool
+from GUNICORN_THREADS.
+"""
+import os
+import shutil
+
+from prometheus_client import multiprocess
+
+
+def shares_state():
+    """Checks if all workers see the response cache, writer pins and live results of the others
+
+    That needs RESPONSE_CACHE=redis, or off if there are no replicas to pin
+    writers to, and LIVE_RESULTS=postgres or off.
+    """
+    response_cache = os.environ.get('RESPONSE_CACHE', 'memory')
+    replicas = os.environ.get('DATABASE_REPLICA_URLS', '').strip()
+    return (response_cache == 'redis' or response_cache == 'off' and not replicas) \
+        and os.environ.get('LIVE_RESULTS', 'memory') != 'memory'
+
+
+# Heroku sets WEB_CONCURRENCY from the dyno size
+concurrency = int(os.environ.get('WEB_CONCURRENCY', 2))
+workers = concurrency if shares_state() else 1
+worker_class = 'gthread'
+threads = int(os.environ.setdefault('GUNICORN_THREADS', '32'))
+
+
+def on_starting(server):
+    if workers < concurrency:
+        server.log.warning('Starting 1 worker instead of %d, set RESPONSE_CACHE=redis and '
+                           'LIVE_RESULTS=postgres to share state between workers', concurrency)
+    # metrics files of a previous run would be added to this one
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,118 @@
+import os
+import re
+import csv
+import io
+from flask import request, abort
+
+from models import db, parse_time, season_of, create_season_partitions, DISTANCES, Swimmer, Result
+
+
+MAX_BULK_ROWS = int(os.environ.get('MAX_BULK_ROWS', 10000))
+STROKES = Result.stroke.type.enums
+COURSES = Result.course.type.enums
+FIELDS = ['swimmer id', 'course', 'distance', 'stroke', 'time']
+INTEGER_FIELDS = ['swimmer id', 'distance']
+# integers in CSV are plain decimal digits, without sign, leading zeros or fraction
+CSV_INTEGER = re.compile(r'[1-9][0-9]*')
+
+
+def _csv_row(row):
+    """Converts the integer fields of a CSV row to int, as they are in JSON, if they are written as CSV_INTEGER
+    """
+    for field in INTEGER_FIELDS:
+        value = row.get(field)
+        if value is not None and CSV_INTEGER.fullmatch(value):
+            row[field] = int(value)
+    return row
+
+
+def _integer(row, field):
+    value = row[field]
+    # bool is a subclass of int, and int() would truncate 12.7 or accept "0012"
+    if type(value) is not int:
+        raise ValueError(f'{field} must be an integer, not {value!r}')
+    return value
+
+
+def read_rows():
+    """Reads the rows of a bulk request, given as JSON array or as CSV with a header line
+
+    Aborts with 400 if the body cannot be parsed or has too many rows.
+    """
+    if request.mimetype == 'text/csv':
+        try:
+            rows = [_csv_row(row) for row in csv.DictReader(io.StringIO(request.get_data(as_text=True)))]
+        except csv.Error:
+            abort(400)
+    else:
+        rows = request.get_json(silent=True)
+        if not isinstance(rows, list):
+            abort(400)
+
+    if not rows or len(rows) > MAX_BULK_ROWS:
+        abort(400)
+    return rows
+
+
+def validate_rows(meet, rows):
+    """Validates all rows of results of a meet up front
+
+    Returns the valid rows as column dictionaries and a list of errors,
+    each with the index of the offending row.
+    """
+    valid = []
+    errors = []
+    season = season_of(meet.start_date)
+
+    swimmer_ids = {row.get('swimmer id') for row in rows
+                   if isinstance(row, dict) and type(row.get('swimmer id')) is int}
+    known_swimmers = {swimmer_id for swimmer_id, in
+                      db.session.query(Swimmer.id).filter(Swimmer.id.in_(swimmer_ids))}
+
+    for index, row in enumerate(rows):
+        try:
+            if not isinstance(row, dict):
+                raise ValueError('row must be an object')
+            missing = [field for field in FIELDS if row.get(field) in (None, '')]
+            if missing:
+                raise ValueError(f'missing {", ".join(missing)}')
+            swimmer_id = _integer(row, 'swimmer id')
+            if swimmer_id not in known_swimmers:
+                raise ValueError(f'unknown swimmer {swimmer_id}')
+            if row['course'] not in COURSES:
+                raise ValueError(f'invalid course {row["course"]!r}')
+            if row['stroke'] not in STROKES:
+                raise ValueError(f'invalid stroke {row["stroke"]!r}')
+            distance = _integer(row, 'distance')
+            if distance not in DISTANCES:
+                raise ValueError(f'invalid distance {distance}')
+            time = parse_time(str(row['time']))
+        except (TypeError, ValueError) as error:
+            errors.append({'row': index, 'message': str(error)})
+            continue
+
+        valid.append({
+            'swimmer_id': swimmer_id,
+            'meet_id': meet.id,
+            'course': row['course'],
+            'distance': distance,
+            'stroke': row['stroke'],
+            'time': time,
+            'season': season
+        })
+
+    return valid, errors
+
+
+def insert_rows(rows):
+    """Inserts rows into results with one multi-row INSERT and returns their ids
+
+    The caller commits, so the insert and the leaderboard refresh form a
+    single transaction. The partitions of their seasons are created if
+    they are missing, e.g. after a season was detached.
+    """
+    if not rows:
+        return []
+    create_season_partitions(db.session.connection(), {row['season'] for row in rows})
+    statement = Result.__table__.insert().values(rows).returning(Result.__table__.c.id)
+    return [result_id for result_id, in db.session.execute(statement)]
@@ -0,0 +1,323 @@
+import os
+import json
+import logging
+import queue
+import secrets
+import select
+import threading
+import time
+from collections import deque, namedtuple
+from itertools import chain
+from types import SimpleNamespace
+from flask import current_app, request
+from sqlalchemy import event, inspect, text
+
+from models import db, Result
+from serializers import format_result, encode
+
+
+# memory (events of writes handled by this worker) or postgres (LISTEN/NOTIFY, events of all workers)
+LIVE_RESULTS = os.environ.get('LIVE_RESULTS', 'memory')
+# open streams per worker, each holds a worker thread, so keep this below the number of threads
+LIVE_MAX_SUBSCRIBERS = int(os.environ.get('LIVE_MAX_SUBSCRIBERS', 24))
+# events queued for a slow client before its stream is closed, it resumes with Last-Event-ID
+LIVE_BUFFER_SIZE = int(os.environ.get('LIVE_BUFFER_SIZE', 1000))
+# recent events of all meets kept per worker to resume streams from
+LIVE_HISTORY_SIZE = int(os.environ.get('LIVE_HISTORY_SIZE', 10000))
+# seconds between keep-alive comments, which also detect closed connections
+LIVE_HEARTBEAT = int(os.environ.get('LIVE_HEARTBEAT', 15))
+SSE_MIMETYPE = 'text/event-stream'
+NOTIFY_CHANNEL = 'live_results'
+
+logger = logging.getLogger(__name__)
+
+Event = namedtuple('Event', ['sequence', 'meet_id', 'kind', 'data'])
+
+
+class Subscription:
+    """Bounded queue of the events of one meet for one client
+    """
+    def __init__(self, meet_id, maxsize):
+        self.meet_id = meet_id
+        self.queue = queue.Queue(maxsize)
+        self.overflowed = False
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+
+class Broker:
+    """In-process publish/subscribe of result events per meet
+
+    Events are numbered in the order they are published. Their id is the
+    number prefixed with the epoch of the broker, so ids from another worker
+    or from before a restart are recognized and cannot be resumed from.
+    """
+    def __init__(self, max_subscribers=LIVE_MAX_SUBSCRIBERS, buffer_size=LIVE_BUFFER_SIZE,
+                 history_size=LIVE_HISTORY_SIZE):
+        self.max_subscribers = max_subscribers
+        self.buffer_size = buffer_size
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._history = deque(maxlen=history_size)
+        self._sequence = 0
+        self.reset()
+
+    def reset(self):
+        """Starts a new epoch, used when events may have been lost
+        """
+        with self._lock:
+            self.epoch = secrets.token_hex(4)
+            self._history.clear()
+
+    def event_id(self, event):
+        return f'{self.epoch}-{event.sequence}'
+
+    @property
+    def subscriber_count(self):
+        return sum(len(subscriptions) for subscriptions in self._subscribers.values())
+
+    def subscribe(self, meet_id):
+        """Returns a new subscription or None if the worker has no capacity left
+        """
+        with self._lock:
+            if self.subscriber_count >= self.max_subscribers:
+                return None
+            subscription = Subscription(meet_id, self.buffer_size)
+            self._subscribers.setdefault(meet_id, set()).add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.meet_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscribers.pop(subscription.meet_id, None)
+
+    def publish(self, meet_id, kind, data):
+        with self._lock:
+            self._sequence += 1
+            event = Event(self._sequence, meet_id, kind, data)
+            self._history.append(event)
+            for subscription in self._subscribers.get(meet_id, ()):
+                subscription.put(event)
+        return event
+
+    def current_id(self):
+        with self._lock:
+            return f'{self.epoch}-{self._sequence}'
+
+    def since(self, meet_id, last_event_id):
+        """Returns the events of a meet published after the given event id
+
+        Returns None if the id is unknown or older than the kept history.
+        """
+        epoch, _, sequence = (last_event_id or '').partition('-')
+        with self._lock:
+            if epoch != self.epoch or not sequence.isdigit() or int(sequence) > self._sequence:
+                return None
+            sequence = int(sequence)
+            oldest = self._history[0].sequence if self._history else self._sequence + 1
+            if sequence < oldest - 1:
+                return None
+            return [event for event in self._history
+                    if event.sequence > sequence and event.meet_id == meet_id]
+
+
+broker = Broker()
+live_backend = None
+
+
+def result_event(result):
+    """Returns (meet id, kind, data) of the event for an inserted or edited result row or object
+    """
+    return result.meet_id, 'result', encode(format_result(result))
+
+
+def deleted_event(meet_id, result_id):
+    return meet_id, 'delete', encode({'id': result_id})
+
+
+def inserted_events(ids, rows):
+    """Returns the events of rows inserted without the ORM, e.g. by the bulk import
+    """
+    return [result_event(SimpleNamespace(id=result_id, **row)) for result_id, row in zip(ids, rows)]
+
+
+def queue_events(session, events):
+    """Publishes events once the session commits
+
+    With the postgres backend they are sent with NOTIFY inside the
+    transaction, which Postgres delivers on commit and drops on rollback.
+    """
+    if not events or live_backend is None:
+        return
+    if live_backend == 'postgres':
+        session.connection().execute(
+            text('SELECT pg_notify(:channel, payload) FROM unnest(:payloads) AS payload'),
+            channel=NOTIFY_CHANNEL,
+            payloads=[json.dumps(event) for event in events])
+    else:
+        session.info.setdefault('live_events', []).extend(events)
+
+
+def _changed_events(session):
+    events = []
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if not isinstance(obj, Result):
+            continue
+        if obj in session.deleted:
+            events.append(deleted_event(obj.meet_id, obj.id))
+            continue
+        # a result moved to another meet disappears from the old one
+        previous = inspect(obj).attrs.meet_id.history.deleted
+        if previous and previous[0] != obj.meet_id:
+            events.append(deleted_event(previous[0], obj.id))
+        events.append(result_event(obj))
+    return events
+
+
+def _collect_events(session, flush_context):
+    queue_events(session, _changed_events(session))
+
+
+def _publish_events(session):
+    for meet_id, kind, data in session.info.pop('live_events', ()):
+        broker.publish(meet_id, kind, data)
+
+
+def _discard_events(session):
+    session.info.pop('live_events', None)
+
+
+class PostgresListener:
+    """Publishes the events that all workers NOTIFY to the broker of this worker
+
+    Runs in a daemon thread on a connection of its own. After the connection
+    was lost the broker starts a new epoch, so clients reconnecting with
+    Last-Event-ID get a full snapshot instead of silently missing events.
+    """
+    def __init__(self, engine, broker):
+        self.engine = engine
+        self.broker = broker
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self._listen()
+            except Exception:
+                logger.exception('listening for live results failed, reconnecting')
+            self.broker.reset()
+            time.sleep(1)
+
+    def _listen(self):
+        connection = self.engine.raw_connection()
+        try:
+            connection.connection.set_isolation_level(0)
+            connection.cursor().execute(f'LISTEN {NOTIFY_CHANNEL}')
+            dbapi_connection = connection.connection
+            while True:
+                if not select.select([dbapi_connection], [], [], LIVE_HEARTBEAT)[0]:
+                    continue
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    notify = dbapi_connection.notifies.pop(0)
+                    self.broker.publish(*json.loads(notify.payload))
+        finally:
+            connection.invalidate()
+
+
+listener = None
+
+
+def _format_event(event_id, kind, data):
+    return f'id: {event_id}\nevent: {kind}\ndata: {data}\n\n'
+
+
+def event_stream(meet_id, snapshot, expires=None):
+    """Returns a response streaming the result events of a meet as Server-Sent Events
+
+    A client resuming with Last-Event-ID gets the events it missed. If
+    they are no longer known, e.g. after a restart or on another worker,
+    snapshot() is called for the current results of the meet, which are
+    sent as result events first. Clients should treat result events as
+    upserts by result id. The stream ends when the access token expires.
+
+    Returns None if the worker already serves LIVE_MAX_SUBSCRIBERS streams.
+    All database work is done before returning, so the stream holds no
+    database connection.
+    """
+    if listener is not None:
+        listener.start()
+
+    subscription = broker.subscribe(meet_id)
+    if subscription is None:
+        return None
+
+    missed = broker.since(meet_id, request.headers.get('Last-Event-ID'))
+    if missed is None:
+        # subscribed first, so a result written meanwhile is sent twice rather than lost
+        event_id = broker.current_id()
+        try:
+            rows = snapshot()
+        except Exception:
+            broker.unsubscribe(subscription)
+            raise
+        initial = [_format_event(event_id, 'result', encode(format_result(row))) for row in rows]
+    else:
+        initial = [_format_event(broker.event_id(event), event.kind, event.data) for event in missed]
+
+    def generate():
+        try:
+            yield f'retry: {LIVE_HEARTBEAT * 1000}\n\n' + ''.join(initial)
+            while not subscription.overflowed:
+                timeout = LIVE_HEARTBEAT
+                if expires is not None:
+                    timeout = min(timeout, expires - time.time())
+                    if timeout <= 0:
+                        return
+                try:
+                    event = subscription.queue.get(timeout=timeout)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield _format_event(broker.event_id(event), event.kind, event.data)
+        finally:
+            broker.unsubscribe(subscription)
+
+    response = current_app.response_class(generate(), mimetype=SSE_MIMETYPE)
+    response.headers['Cache-Control'] = 'no-cache'
+    # tells nginx style proxies not to buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(lambda: broker.unsubscribe(subscription))
+    return response
+
+
+def setup_live_results(app, backend=LIVE_RESULTS):
+    """Configures where result events come from and publishes them on every commit that changes results
+
+    Writes that bypass the ORM must call queue_events themselves.
+    """
+    global live_backend, listener
+
+    live_backend = backend if backend in ('memory', 'postgres') else None
+    listener = None
+    if live_backend == 'postgres':
+        with app.app_context():
+            listener = PostgresListener(db.engine, broker)
+
+    if not event.contains(db.session, 'after_flush', _collect_events):
+        event.listen(db.session, 'after_flush', _collect_events)
+        event.listen(db.session, 'after_commit', _publish_events)
+        event.listen(db.session, 'after_rollback', _discard_events)
@@ -0,0 +1,71 @@
+import base64
+import json
+import time
+import uuid
+import rsa
+from jose import jwt
+
+from auth import AUTH0_DOMAIN, API_AUDIENCE
+
+
+# permissions of the roles set up in Auth0, see the README, and of a client with all of them
+READ_PERMISSIONS = ['get:swimmers', 'get:swimmer-details', 'get:swimmer-results',
+                    'get:meets', 'get:meet-details', 'get:meet-results', 'get:results']
+ROLE_PERMISSIONS = {
+    'swimmer': READ_PERMISSIONS,
+    'coach': READ_PERMISSIONS + ['create:swimmer', 'edit:swimmer', 'delete:swimmer'],
+    'official': READ_PERMISSIONS + ['create:meet', 'edit:meet', 'delete:meet', 'create:results']
+}
+ROLE_PERMISSIONS['all'] = sorted(set().union(*ROLE_PERMISSIONS.values()))
+
+
+def _base64url_uint(value):
+    data = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+class LocalIssuer:
+    """Signs RS256 tokens with a locally generated key, in place of Auth0
+    """
+    def __init__(self, kid='local', bits=2048):
+        self.kid = kid
+        self.public_key, self.private_key = rsa.newkeys(bits)
+        self._private_pem = self.private_key.save_pkcs1().decode()
+
+    def jwks(self):
+        """Returns the public key as a JSON Web Key Set
+        """
+        return {
+            'keys': [{
+                'kid': self.kid,
+                'kty': 'RSA',
+                'use': 'sig',
+                'alg': 'RS256',
+                'n': _base64url_uint(self.public_key.n),
+                'e': _base64url_uint(self.public_key.e)
+            }]
+        }
+
+    def write_jwks(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.jwks(), f)
+
+    def mint(self, permissions, expires_in=3600, **claims):
+        """Returns a signed access token carrying the given permissions
+        """
+        now = int(time.time())
+        payload = {
+            'iss': f'https://{AUTH0_DOMAIN}/',
+            'aud': API_AUDIENCE,
+            'sub': f'local|{uuid.uuid4().hex}',
+            'iat': now,
+            'exp': now + expires_in,
+            'permissions': list(permissions)
+        }
+        payload.update(claims)
+        return jwt.encode(payload, self._private_pem, algorithm='RS256', headers={'kid': self.kid})
+
+    def mint_role(self, role, **claims):
+        """Returns a signed access token with the permissions of a role in ROLE_PERMISSIONS
+        """
+        return self.mint(ROLE_PERMISSIONS[role], **claims)
@@ -1,8 +1,17 @@
+import os
+import time
+# migrations and rebuilds may run longer than any request
+os.environ.setdefault('DB_STATEMENT_TIMEOUT', '0')
+
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 
 from app import app
-from models import db
+from sqlalchemy import text, select, table, column
+
+from models import (db, refresh_leaderboard, create_season_partitions, season_partition,
+                    LEADERBOARD_KEY)
+from cache import invalidate, result_tags
 
 migrate = Migrate(app, db)
 manager = Manager(app)
@@ -10,5 +19,79 @@ manager = Manager(app)
 manager.add_command('db', MigrateCommand)
 
 
+@manager.command
+def rebuild_leaderboard():
+    """Rebuilds the leaderboard from all results, e.g. after loading results with SQL"""
+    with db.engine.begin() as connection:
+        refresh_leaderboard(connection)
+
+
+@manager.option('--batch-size', dest='batch_size', type=int, default=10000, help='ids per transaction')
+@manager.option('--pause', dest='pause', type=float, default=0.1, help='seconds to sleep between batches')
+def backfill_result_times(batch_size, pause):
+    """Fills results.time_cs between the migrations a4c7e2f9b318 and 1d8b5e3a9c62
+
+    Each batch of ids is updated in its own short transaction, so rows are
+    locked only briefly while the table stays in use, and the pause lets
+    replicas keep up. Can be interrupted and run again.
+    """
+    with db.engine.connect() as connection:
+        first, last = connection.execute('SELECT min(id), max(id) FROM results').first()
+    if first is None:
+        return
+    update = text('UPDATE results SET time_cs = round(extract(epoch FROM time) * 100) '
+                  'WHERE id >= :start AND id < :end AND time_cs IS NULL')
+    filled = 0
+    for start in range(first, last + 1, batch_size):
+        with db.engine.begin() as connection:
+            filled += connection.execute(update, start=start, end=start + batch_size).rowcount
+        print(f'{filled} results filled, up to id {min(start + batch_size, last + 1) - 1} of {last}')
+        time.sleep(pause)
+
+
+@manager.command
+def create_partitions():
+    """Creates the partitions of results for the seasons of all meets, e.g. after loading meets with SQL"""
+    with db.engine.begin() as connection:
+        seasons = [season for season, in connection.execute(
+            'SELECT DISTINCT extract(year FROM start_date)::int FROM meets')]
+        create_season_partitions(connection, seasons)
+
+
+@manager.option('season', type=int, help='season whose results are detached')
+@manager.option('--archive', dest='archive', help='CSV file the results of the season are written to')
+@manager.option('--drop', dest='drop', action='store_true', help='drops the detached partition')
+def detach_season(season, archive, drop):
+    """Removes the results of a season from results by detaching its partition
+
+    Detaching only changes the catalog, the rows stay in a table of their
+    own, which --archive copies to a file and --drop deletes. ATTACH
+    PARTITION brings back a table that was kept. The leaderboard entries of
+    the swimmers of the season are recomputed in the same transaction.
+    """
+    partition = season_partition(season)
+    detached = table(partition, *[column(name) for name in ('swimmer_id', 'meet_id', *LEADERBOARD_KEY)])
+    with db.engine.begin() as connection:
+        connection.execute(f'ALTER TABLE results DETACH PARTITION {partition}')
+        refresh_leaderboard(connection, select([detached.c[name] for name in LEADERBOARD_KEY]).distinct())
+        tags = {tag for swimmer_id, meet_id in
+                connection.execute(select([detached.c.swimmer_id, detached.c.meet_id]).distinct())
+                for tag in result_tags(swimmer_id, meet_id)}
+    # writes that bypass the ORM invalidate the cache themselves
+    invalidate(sorted(tags))
+
+    if archive:
+        connection = db.engine.raw_connection()
+        try:
+            with open(archive, 'w') as file:
+                connection.cursor().copy_expert(f'COPY {partition} TO STDOUT WITH (FORMAT csv, HEADER)', file)
+        finally:
+            connection.close()
+        print(f'results of {season} archived to {archive}')
+    if drop:
+        with db.engine.begin() as connection:
+            connection.execute(f'DROP TABLE {partition}')
+
+
 if __name__ == '__main__':
     manager.run()
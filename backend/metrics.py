@@ -0,0 +1,57 @@
+import os
+import hmac
+from flask import current_app, request, abort
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram, REGISTRY,
+                               CONTENT_TYPE_LATEST, generate_latest, multiprocess)
+
+
+# bearer token a scraper has to send for /metrics, which is disabled without it
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# set for gunicorn with several workers, see gunicorn.conf.py
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+POOL_CHECKOUT_SECONDS = Histogram(
+    'db_pool_checkout_seconds', 'Time to check a connection out of the pool',
+    buckets=(.0001, .0005, .001, .005, .01, .05, .1, .5, 1, 5, 10))
+POOL_CHECKOUT_WAITS = Counter(
+    'db_pool_checkout_waits_total', 'Checkouts that found no idle connection and waited for one')
+POOL_CHECKOUT_TIMEOUTS = Counter(
+    'db_pool_checkout_timeouts_total', 'Checkouts that gave up after the pool timeout')
+POOL_CHECKED_OUT = Gauge(
+    'db_pool_checked_out', 'Connections currently checked out of the pool',
+    multiprocess_mode='livesum')
+
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Time to handle a request, by route',
+    ['method', 'route', 'status'])
+REQUEST_DB_SECONDS = Histogram(
+    'http_request_db_seconds', 'Time a request spent executing SQL statements, by route',
+    ['method', 'route'])
+REQUEST_SQL_STATEMENTS = Histogram(
+    'http_request_sql_statements', 'SQL statements executed per request, by route',
+    ['method', 'route'], buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+REQUEST_AUTH_SECONDS = Histogram(
+    'http_request_auth_seconds', 'Time a request spent checking its access token, by route',
+    ['method', 'route'])
+REQUEST_SERIALIZE_SECONDS = Histogram(
+    'http_request_serialize_seconds', 'Time a request spent formatting and encoding its response, by route',
+    ['method', 'route'])
+
+
+def metrics_response():
+    """Returns all metrics in the Prometheus text format
+
+    With several gunicorn workers, metrics are collected from the files all
+    workers write to MULTIPROC_DIR. Aborts with 404 if no METRICS_TOKEN is
+    configured and with 401 if the request does not carry it.
+    """
+    if not METRICS_TOKEN:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}'):
+        abort(401)
+
+    registry = REGISTRY
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return current_app.response_class(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
@@ -0,0 +1,89 @@
+"""use result time centiseconds
+
+Second of two migrations, see a4c7e2f9b318. Fills the rows the backfill
+has not reached, builds the indexes on time_cs without blocking writes,
+then drops the TIME column and renames time_cs to time. Deploy the code
+that reads time as integer together with this migration.
+
+Revision ID: 1d8b5e3a9c62
+Revises: a4c7e2f9b318
+Create Date: 2026-10-18 18:21:07.147366
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1d8b5e3a9c62'
+down_revision = 'a4c7e2f9b318'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = {
+    'results': [
+        ('ix_results_stroke_distance_course_time', 'stroke, distance, course, {time}, id'),
+        ('ix_results_swimmer_event_time', 'swimmer_id, stroke, distance, course, {time}'),
+        ('ix_results_event_swimmer_time', 'stroke, distance, course, swimmer_id, {time}'),
+    ],
+    'leaderboard': [
+        ('ix_leaderboard_event_time', 'stroke, distance, course, {time}, swimmer_id'),
+        ('ix_leaderboard_event_gender_time', 'stroke, distance, course, gender, {time}, swimmer_id'),
+    ]
+}
+
+
+def upgrade():
+    # all rows if the backfill was skipped, which locks them until the migration commits
+    for table in INDEXES:
+        op.execute(f'UPDATE {table} SET time_cs = round(extract(epoch FROM time) * 100) WHERE time_cs IS NULL')
+
+    # results is written to meanwhile, so its indexes are built concurrently and
+    # NOT NULL is proven by a validated check instead of a scan under an exclusive lock
+    with op.get_context().autocommit_block():
+        for name, columns in INDEXES['results']:
+            op.execute(f'CREATE INDEX CONCURRENTLY {name}_cs ON results ({columns.format(time="time_cs")})')
+        op.execute('ALTER TABLE results ADD CONSTRAINT results_time_cs_not_null CHECK (time_cs IS NOT NULL) NOT VALID')
+        op.execute('ALTER TABLE results VALIDATE CONSTRAINT results_time_cs_not_null')
+
+    for name, columns in INDEXES['leaderboard']:
+        op.execute(f'CREATE INDEX {name}_cs ON leaderboard ({columns.format(time="time_cs")})')
+    op.alter_column('results', 'time_cs', nullable=False)
+    op.drop_constraint('results_time_cs_not_null', 'results', type_='check')
+    op.alter_column('leaderboard', 'time_cs', nullable=False)
+
+    for table, indexes in INDEXES.items():
+        op.execute(f'DROP TRIGGER {table}_sync_time_cs ON {table}')
+        # drops the indexes on time as well
+        op.drop_column(table, 'time')
+        op.alter_column(table, 'time_cs', new_column_name='time')
+        for name, _ in indexes:
+            op.execute(f'ALTER INDEX {name}_cs RENAME TO {name}')
+    op.execute('DROP FUNCTION sync_time_cs()')
+
+
+def downgrade():
+    op.execute("""
+        CREATE FUNCTION sync_time_cs() RETURNS trigger AS $$
+        BEGIN
+            NEW.time_cs := round(extract(epoch FROM NEW.time) * 100);
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    for table, indexes in INDEXES.items():
+        op.alter_column(table, 'time', new_column_name='time_cs')
+        # before this migration time_cs has no indexes, they are recreated on time below
+        for name, _ in indexes:
+            op.execute(f'DROP INDEX {name}')
+        op.add_column(table, sa.Column('time', sa.Time(), nullable=True))
+        op.execute(f"UPDATE {table} SET time = (time_cs * interval '10 milliseconds')::time")
+        op.alter_column(table, 'time', nullable=False)
+        op.alter_column(table, 'time_cs', nullable=True)
+        for name, columns in indexes:
+            op.execute(f'CREATE INDEX {name} ON {table} ({columns.format(time="time")})')
+        op.execute(f"""
+            CREATE TRIGGER {table}_sync_time_cs BEFORE INSERT OR UPDATE OF time ON {table}
+            FOR EACH ROW EXECUTE PROCEDURE sync_time_cs()
+        """)
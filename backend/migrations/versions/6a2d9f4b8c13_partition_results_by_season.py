@@ -0,0 +1,108 @@
+"""partition results by season
+
+Replaces results with a table range-partitioned by season, the calendar
+year in which the meet of a result starts, copied to every result. Each
+season has its own partition named results_<season>, created by the
+application whenever a meet of a new season is written.
+
+The rows are copied in this migration. results stays readable meanwhile,
+but writes to it wait until the migration commits, which takes time in
+proportion to the table. Deploy the code that writes the season together
+with this migration.
+
+Revision ID: 6a2d9f4b8c13
+Revises: 1d8b5e3a9c62
+Create Date: 2026-10-18 20:04:52.381920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a2d9f4b8c13'
+down_revision = '1d8b5e3a9c62'
+branch_labels = None
+depends_on = None
+
+
+COLUMNS = 'id, swimmer_id, meet_id, course, distance, stroke, time'
+
+TABLE = """
+    CREATE TABLE {name} (
+        id INTEGER NOT NULL DEFAULT nextval('results_id_seq'),
+        swimmer_id INTEGER NOT NULL,
+        meet_id INTEGER NOT NULL,
+        course course NOT NULL,
+        distance INTEGER NOT NULL,
+        stroke stroke NOT NULL,
+        time INTEGER NOT NULL,
+        {extra}
+    ){options}
+"""
+
+INDEXES = [
+    ('ix_results_meet_id', 'meet_id'),
+    ('ix_results_stroke_distance_course_time', 'stroke, distance, course, time, id'),
+    ('ix_results_swimmer_event_time', 'swimmer_id, stroke, distance, course, time'),
+    ('ix_results_event_swimmer_time', 'stroke, distance, course, swimmer_id, time'),
+]
+
+
+def create_results_copy(extra, options=''):
+    """Creates results_new next to results, the sequence of ids is taken over by the new table
+
+    Its primary key is named results_new_pkey, results_pkey still belongs to results.
+    """
+    # reads continue on the old table, writes wait until the migration commits
+    op.execute('LOCK TABLE results IN EXCLUSIVE MODE')
+    op.execute('ALTER SEQUENCE results_id_seq OWNED BY NONE')
+    op.execute(TABLE.format(name='results_new', extra=extra, options=options))
+
+
+def swap_results():
+    """Replaces results with results_new and restores its constraints and indexes
+    """
+    op.execute('DROP TABLE results')
+    op.execute('ALTER TABLE results_new RENAME TO results')
+    op.execute('ALTER TABLE results RENAME CONSTRAINT results_new_pkey TO results_pkey')
+    op.execute('ALTER SEQUENCE results_id_seq OWNED BY results.id')
+    op.execute('ALTER TABLE results ADD CONSTRAINT results_distance_check '
+               'CHECK (distance IN (25, 50, 100, 200, 400, 800, 1500))')
+    op.execute('ALTER TABLE results ADD CONSTRAINT results_meet_id_fkey '
+               'FOREIGN KEY (meet_id) REFERENCES meets (id)')
+    op.execute('ALTER TABLE results ADD CONSTRAINT results_swimmer_id_fkey '
+               'FOREIGN KEY (swimmer_id) REFERENCES swimmers (id)')
+    # on a partitioned table they are created on every partition, and on partitions added later
+    for name, columns in INDEXES:
+        op.execute(f'CREATE INDEX {name} ON results ({columns})')
+    op.execute('ANALYZE results')
+
+
+def upgrade():
+    create_results_copy('season INTEGER NOT NULL,\n        CONSTRAINT results_new_pkey PRIMARY KEY (id, season)',
+                        ' PARTITION BY RANGE (season)')
+
+    # the seasons of all meets, and the current and next one for meets yet to come
+    seasons = [season for season, in op.get_bind().execute(sa.text("""
+        SELECT extract(year FROM start_date)::int FROM meets
+        UNION SELECT extract(year FROM current_date)::int + offset_years FROM generate_series(0, 1) AS offset_years
+        ORDER BY 1
+    """))]
+    for season in seasons:
+        op.execute(f'CREATE TABLE results_{season} PARTITION OF results_new '
+                   f'FOR VALUES FROM ({season}) TO ({season + 1})')
+
+    op.execute(f"""
+        INSERT INTO results_new ({COLUMNS}, season)
+        SELECT {', '.join(f'r.{column}' for column in COLUMNS.split(', '))}, extract(year FROM m.start_date)
+        FROM results r JOIN meets m ON m.id = r.meet_id
+    """)
+    swap_results()
+
+
+def downgrade():
+    # detached seasons are left as they are, attach them before to keep their results
+    create_results_copy('CONSTRAINT results_new_pkey PRIMARY KEY (id)')
+    op.execute(f'INSERT INTO results_new ({COLUMNS}) SELECT {COLUMNS} FROM results')
+    swap_results()
@@ -0,0 +1,35 @@
+"""add search indexes
+
+Revision ID: 7e2b9c4d1f58
+Revises: 5b8f2d9e4c07
+Create Date: 2026-10-18 16:42:09.318522
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e2b9c4d1f58'
+down_revision = '5b8f2d9e4c07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # the expressions must match SWIMMER_SEARCH_TEXT and MEET_SEARCH_TEXT in models.py
+    op.execute("""
+        CREATE INDEX ix_swimmers_search_trgm ON swimmers
+        USING gin (lower(first_name || ' ' || last_name) gin_trgm_ops)
+    """)
+    op.execute("""
+        CREATE INDEX ix_meets_search_trgm ON meets
+        USING gin (lower(name || ' ' || coalesce(city, '') || ' ' || coalesce(country, '')) gin_trgm_ops)
+    """)
+
+
+def downgrade():
+    op.drop_index('ix_meets_search_trgm', table_name='meets')
+    op.drop_index('ix_swimmers_search_trgm', table_name='swimmers')
+    # the extension is left installed, other database objects may use it
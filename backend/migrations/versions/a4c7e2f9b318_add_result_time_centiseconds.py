@@ -0,0 +1,49 @@
+"""add result time centiseconds
+
+First of two migrations that store result times as integer hundredths of a
+second instead of TIME. Adds the column time_cs next to time, and a trigger
+that fills it on every insert and on every update of time. Deployed code
+keeps working with time meanwhile. Then fill the existing rows in batches
+with `python manage.py backfill_result_times` and upgrade to 1d8b5e3a9c62.
+
+Revision ID: a4c7e2f9b318
+Revises: 7e2b9c4d1f58
+Create Date: 2026-10-18 17:58:31.604729
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c7e2f9b318'
+down_revision = '7e2b9c4d1f58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # nullable without default, so adding the column does not rewrite the table
+    op.add_column('results', sa.Column('time_cs', sa.Integer(), nullable=True))
+    op.add_column('leaderboard', sa.Column('time_cs', sa.Integer(), nullable=True))
+    op.execute("""
+        CREATE FUNCTION sync_time_cs() RETURNS trigger AS $$
+        BEGIN
+            NEW.time_cs := round(extract(epoch FROM NEW.time) * 100);
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    for table in ('results', 'leaderboard'):
+        op.execute(f"""
+            CREATE TRIGGER {table}_sync_time_cs BEFORE INSERT OR UPDATE OF time ON {table}
+            FOR EACH ROW EXECUTE PROCEDURE sync_time_cs()
+        """)
+
+
+def downgrade():
+    for table in ('results', 'leaderboard'):
+        op.execute(f'DROP TRIGGER {table}_sync_time_cs ON {table}')
+    op.execute('DROP FUNCTION sync_time_cs()')
+    op.drop_column('leaderboard', 'time_cs')
+    op.drop_column('results', 'time_cs')
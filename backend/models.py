@@ -1,20 +1,221 @@
 import os
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Column, Integer, String, Enum, Date, Time, ForeignKey, CheckConstraint
-from sqlalchemy.orm import relationship
+import re
+import time
+import threading
+from itertools import chain, count
+from flask import g, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import Column, Integer, String, Enum, Date, ForeignKey, CheckConstraint, Index
+from sqlalchemy import event, exc, func, inspect, literal_column, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.expression import UpdateBase
+
+from metrics import POOL_CHECKOUT_SECONDS, POOL_CHECKOUT_WAITS, POOL_CHECKOUT_TIMEOUTS, POOL_CHECKED_OUT
 
 
 database_path = os.environ['DATABASE_URL']
+# comma separated URLs of read replicas of that database, which serve read-only requests
+replica_paths = [path.strip() for path in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if path.strip()]
+
+# requests a worker process handles at once, set by gunicorn.conf.py
+GUNICORN_THREADS = int(os.environ.get('GUNICORN_THREADS', 1))
+# connections kept open per worker process, by default one per thread up to 10
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', min(GUNICORN_THREADS, 10)))
+# connections opened beyond the pool size under load, workers * (size + overflow)
+# must stay below the connection limit of the database
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 0))
+# seconds a request waits for a free connection before failing with 503
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 5))
+# seconds after which a connection is replaced, below the idle timeouts of server and proxies
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+# tests connections with a round trip on checkout, so dropped ones are replaced transparently
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+# milliseconds after which Postgres cancels a statement, 0 disables the limit
+DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 30000))
+# seconds a replica is skipped after connecting to it failed or its connection was lost
+DB_REPLICA_EJECT_SECONDS = int(os.environ.get('DB_REPLICA_EJECT_SECONDS', 30))
+# seconds a client reads from the primary after it wrote, so it sees its writes despite replication lag
+DB_REPLICA_PIN_SECONDS = int(os.environ.get('DB_REPLICA_PIN_SECONDS', 5))
+
+
+class ReplicaSet:
+    """Read replicas handed out round-robin, skipping those that recently failed
+
+    A replica reported with eject() is skipped for `eject_seconds` and
+    tried again afterwards. Members are engines, or the async database
+    handles of asgi.py.
+    """
+    def __init__(self, members, eject_seconds=DB_REPLICA_EJECT_SECONDS):
+        self.members = list(members)
+        self.eject_seconds = eject_seconds
+        self._ejected = {}
+        self._turns = count()
+        self._lock = threading.Lock()
+
+    def choose(self):
+        """Returns the next healthy replica or None if all of them are ejected
+        """
+        now = time.monotonic()
+        with self._lock:
+            for _ in self.members:
+                member = self.members[next(self._turns) % len(self.members)]
+                if self._ejected.get(member, 0) <= now:
+                    return member
+        return None
+
+    def eject(self, member):
+        with self._lock:
+            self._ejected[member] = time.monotonic() + self.eject_seconds
+
+    def watch(self, engine):
+        """Ejects an engine whenever connecting fails or a connection turns out to be lost
+        """
+        @event.listens_for(engine, 'handle_error')
+        def eject_on_disconnect(context):
+            if context.connection is None or context.is_disconnect:
+                self.eject(engine)
+
+
+class RoutingSession(SignallingSession):
+    """Session that runs the queries of read-only requests on a read replica
+
+    Requests with g.read_replica set read from a replica, see replicas.py.
+    Flushes and other writes always go to the primary. The replica chosen
+    for the first query serves the session until it is removed at the end
+    of the request, so a request sees one consistent state.
+    """
+    def get_bind(self, mapper=None, clause=None):
+        replicas = self.app.extensions.get('replicas')
+        if replicas is not None and not self._flushing and not isinstance(clause, UpdateBase) \
+                and has_request_context() and g.get('read_replica'):
+            if 'replica' not in self.info:
+                self.info['replica'] = replicas.choose()
+            if self.info['replica'] is not None:
+                return self.info['replica']
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records checkout times, waits and timeouts in metrics
+    """
+    def _do_get(self):
+        waited = not self.checkedin() and self.overflow() >= self._max_overflow
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            POOL_CHECKOUT_TIMEOUTS.inc()
+            raise
+        finally:
+            POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - start)
+            if waited:
+                POOL_CHECKOUT_WAITS.inc()
+        POOL_CHECKED_OUT.inc()
+        return connection
+
+    def _do_return_conn(self, connection):
+        POOL_CHECKED_OUT.dec()
+        super()._do_return_conn(connection)
+
+
+def engine_options(database_path):
+    """Returns the pool and timeout options of the engine for a Postgres database
+    """
+    if make_url(database_path).get_backend_name() not in ('postgres', 'postgresql'):
+        return {}
+    return {
+        'poolclass': TimedQueuePool,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+        'connect_args': {'options': f'-c statement_timeout={DB_STATEMENT_TIMEOUT}'}
+    }
 
-db = SQLAlchemy()
 
+DISTANCES = (25, 50, 100, 200, 400, 800, 1500)
+TIME_PATTERN = re.compile(r'(?:(\d{1,2}):)?(\d{1,2})(?:\.(\d{1,2}))?')
 
-def setup_db(app, database_path=database_path):
+
+# "M:SS." of every second up to 100 minutes and ".ss" digits, so formatting a time is two lookups
+_SECONDS = [f'{seconds // 60}:{seconds % 60:02d}.' for seconds in range(6000)]
+_HUNDREDTHS = [f'{hundredths:02d}' for hundredths in range(100)]
+
+
+def format_time(time):
+    """Formats a result time given in hundredths of a second as "M:SS.ss"
+    """
+    seconds, hundredths = divmod(time, 100)
+    if seconds < len(_SECONDS):
+        return _SECONDS[seconds] + _HUNDREDTHS[hundredths]
+    return f'{seconds // 60}:{seconds % 60:02d}.{hundredths:02d}'
+
+
+def parse_time(value):
+    """Parses a result time given as "M:SS.ss" or "SS.ss" into hundredths of a second
+
+    Raises ValueError if it is invalid.
+    """
+    match = TIME_PATTERN.fullmatch(value.strip())
+    if not match:
+        raise ValueError(f'invalid time {value!r}')
+    minutes, seconds, fraction = match.groups()
+    minutes, seconds = int(minutes or 0), int(seconds)
+    if minutes > 59 or seconds > 59:
+        raise ValueError(f'invalid time {value!r}')
+    hundredths = int(fraction.ljust(2, '0')) if fraction else 0
+    return (minutes * 60 + seconds) * 100 + hundredths
+
+
+def season_of(date):
+    """Returns the season of a meet starting on date, the calendar year in which it starts
+    """
+    return date.year
+
+
+def setup_db(app, database_path=database_path, replica_paths=replica_paths):
+    """Configures the database, and the read replicas that read-only requests may use
+    """
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
+    app.config["SQLALCHEMY_BINDS"] = {f'replica{i}': path for i, path in enumerate(replica_paths)}
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
     db.app = app
     db.init_app(app)
 
+    app.extensions.pop('replicas', None)
+    if replica_paths:
+        replicas = ReplicaSet(db.get_engine(app, bind) for bind in app.config["SQLALCHEMY_BINDS"])
+        for engine in replicas.members:
+            replicas.watch(engine)
+        app.extensions['replicas'] = replicas
+
+
+def swimmer_search_text(first_name, last_name):
+    """Returns the lowercased text GET /search matches swimmers against, see search.py
+    """
+    return func.lower(first_name + literal_column("' '") + last_name)
+
+
+def meet_search_text(name, city, country):
+    """Returns the lowercased text GET /search matches meets against, see search.py
+    """
+    return func.lower(name + literal_column("' '") + func.coalesce(city, literal_column("''"))
+                      + literal_column("' '") + func.coalesce(country, literal_column("''")))
+
 
 class Swimmer(db.Model):
     __tablename__ = 'swimmers'
@@ -27,6 +228,13 @@ class Swimmer(db.Model):
 
     results = relationship('Result', cascade = 'all, delete-orphan')
 
+    __table_args__ = (
+        Index('ix_swimmers_gender_birth_year', 'gender', 'birth_year'),
+        # trigram index of the search text, needs the pg_trgm extension
+        Index('ix_swimmers_search_trgm', swimmer_search_text(first_name, last_name).label('search'),
+              postgresql_using='gin', postgresql_ops={'search': 'gin_trgm_ops'}),
+    )
+
     def format(self):
         return {
             'id': self.id,
@@ -53,13 +261,19 @@ class Meet(db.Model):
 
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
-    start_date = Column(Date, nullable=False)
+    start_date = Column(Date, nullable=False, index=True)
     end_date = Column(Date, nullable=False)
     city = Column(String)
     country = Column(String)
 
     results = relationship('Result', cascade = 'all, delete-orphan')
 
+    __table_args__ = (
+        # trigram index of the search text, needs the pg_trgm extension
+        Index('ix_meets_search_trgm', meet_search_text(name, city, country).label('search'),
+              postgresql_using='gin', postgresql_ops={'search': 'gin_trgm_ops'}),
+    )
+
     def format(self):
         return {
             'id': self.id,
@@ -81,21 +295,38 @@ class Meet(db.Model):
     def update(self):
         db.session.commit()
 
+
+SWIMMER_SEARCH_TEXT = swimmer_search_text(Swimmer.first_name, Swimmer.last_name)
+MEET_SEARCH_TEXT = meet_search_text(Meet.name, Meet.city, Meet.country)
+
+
 class Result(db.Model):
     __tablename__ = 'results'
 
-    id = Column(Integer, primary_key=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
     swimmer_id = Column(Integer, ForeignKey('swimmers.id'), nullable=False)
-    meet_id = Column(Integer, ForeignKey('meets.id'), nullable=False)
+    meet_id = Column(Integer, ForeignKey('meets.id'), nullable=False, index=True)
 
     course = Column(Enum('LCM', 'SCM', 'SCY', name='course'), nullable=False)
     distance = Column(Integer, CheckConstraint('distance IN (25, 50, 100, 200, 400, 800, 1500)'), nullable=False)
     stroke = Column(Enum('Back', 'Breast', 'Fly', 'Free', 'IM', name='stroke'), nullable=False)
-    time = Column(Time, nullable=False)
+    # hundredths of a second, so sorting, aggregates and range filters work on plain integers
+    time = Column(Integer, nullable=False)
+    # season of the meet, copied by assign_seasons; the table is partitioned by it, so it is part of the key
+    season = Column(Integer, primary_key=True, autoincrement=False)
 
     swimmer = db.relationship('Swimmer')
     meet = db.relationship('Meet')
 
+    __table_args__ = (
+        # serves filters on an event sorted by time, including the keyset on (time, id)
+        Index('ix_results_stroke_distance_course_time', 'stroke', 'distance', 'course', 'time', 'id'),
+        # serves personal bests (DISTINCT ON per event) and lookups by swimmer
+        Index('ix_results_swimmer_event_time', 'swimmer_id', 'stroke', 'distance', 'course', 'time'),
+        # serves rankings (DISTINCT ON per swimmer within an event)
+        Index('ix_results_event_swimmer_time', 'stroke', 'distance', 'course', 'swimmer_id', 'time'),
+    )
+
     def format(self):
         return {
             'id': self.id,
@@ -104,7 +335,7 @@ class Result(db.Model):
             'course': self.course,
             'distance': self.distance,
             'stroke': self.stroke,
-            'time': self.time.strftime("%-M:%S.%f")[:-4]
+            'time': format_time(self.time)
         }
 
     def insert(self):
@@ -116,4 +347,170 @@ class Result(db.Model):
         db.session.commit()
 
     def update(self):
-        db.session.commit()
\ No newline at end of file
+        db.session.commit()
+
+
+def season_partition(season):
+    """Returns the name of the partition of results that holds the results of a season
+    """
+    return f'results_{int(season)}'
+
+
+def season_partition_ddl(season):
+    """Returns the statement that creates the partition of a season unless it exists
+    """
+    season = int(season)
+    return (f'CREATE TABLE IF NOT EXISTS {season_partition(season)} PARTITION OF results '
+            f'FOR VALUES FROM ({season}) TO ({season + 1})')
+
+
+def create_season_partitions(connection, seasons):
+    """Creates the partitions of results that the given seasons are missing
+
+    A partition that exists is skipped without locking results, so this is
+    cheap enough to run before every write that may start a new season.
+    Other databases than Postgres have no partitions.
+    """
+    if connection.dialect.name != 'postgresql':
+        return
+    for season in sorted(set(seasons)):
+        connection.execute(season_partition_ddl(season))
+
+
+def _result_season(session, result):
+    meet = result.meet
+    if meet is None or meet.id != result.meet_id:
+        meet = session.query(Meet).get(result.meet_id)
+    return season_of(meet.start_date) if meet is not None else None
+
+
+@event.listens_for(db.session, 'before_flush')
+def assign_seasons(session, flush_context, instances):
+    """Copies the season of meets to their results flushed through the ORM
+
+    The partitions of new seasons are created first. When the start date of
+    a meet moves to another season, its results are moved along, which
+    Postgres does by moving the rows to the partition of that season.
+    """
+    seasons = {}
+    moved = {}
+    for obj in chain(session.new, session.dirty):
+        if isinstance(obj, Meet) and (obj in session.new or inspect(obj).attrs.start_date.history.has_changes()):
+            seasons[obj] = season_of(obj.start_date)
+            if obj in session.dirty:
+                moved[obj.id] = seasons[obj]
+        elif isinstance(obj, Result) and (obj.season is None or inspect(obj).attrs.meet_id.history.has_changes()):
+            obj.season = _result_season(session, obj)
+            if obj.season is not None:
+                seasons[obj] = obj.season
+    if not seasons:
+        return
+
+    connection = session.connection()
+    create_season_partitions(connection, seasons.values())
+    results = Result.__table__
+    for meet_id, season in moved.items():
+        connection.execute(results.update()
+                           .where(results.c.meet_id == meet_id)
+                           .where(results.c.season != season)
+                           .values(season=season))
+        for obj in list(session.identity_map.values()):
+            if isinstance(obj, Result) and obj.meet_id == meet_id:
+                set_committed_value(obj, 'season', season)
+
+
+class LeaderboardEntry(db.Model):
+    """Best time of a swimmer per stroke, distance and course
+
+    Entries are derived from results and kept up to date by
+    refresh_leaderboard, they are never written directly.
+    """
+    __tablename__ = 'leaderboard'
+
+    swimmer_id = Column(Integer, ForeignKey('swimmers.id', ondelete='CASCADE'), primary_key=True)
+    stroke = Column(Enum('Back', 'Breast', 'Fly', 'Free', 'IM', name='stroke'), primary_key=True)
+    distance = Column(Integer, primary_key=True)
+    course = Column(Enum('LCM', 'SCM', 'SCY', name='course'), primary_key=True)
+    gender = Column(Enum('F', 'M', 'X', name='gender'), nullable=False)
+    time = Column(Integer, nullable=False)
+    result_id = Column(Integer, nullable=False)
+    meet_id = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index('ix_leaderboard_event_time', 'stroke', 'distance', 'course', 'time', 'swimmer_id'),
+        Index('ix_leaderboard_event_gender_time', 'stroke', 'distance', 'course', 'gender', 'time', 'swimmer_id'),
+    )
+
+
+LEADERBOARD_KEY = ('swimmer_id', 'stroke', 'distance', 'course')
+
+
+def refresh_leaderboard(connection, keys=None):
+    """Recomputes the leaderboard entries of the given swimmer and event keys
+
+    keys is a list of (swimmer_id, stroke, distance, course) tuples or a
+    select returning these columns, e.g. for all results of a meet. Without
+    keys the whole leaderboard is rebuilt.
+    """
+    if isinstance(keys, (list, set, tuple)):
+        if not keys:
+            return
+        keys = list(keys)
+
+    leaderboard = LeaderboardEntry.__table__
+    results = Result.__table__
+
+    best = (select([results.c.swimmer_id, results.c.stroke, results.c.distance, results.c.course,
+                    Swimmer.__table__.c.gender, results.c.time, results.c.id, results.c.meet_id])
+            .select_from(results.join(Swimmer.__table__))
+            .distinct(*[results.c[name] for name in LEADERBOARD_KEY])
+            .order_by(*[results.c[name] for name in LEADERBOARD_KEY], results.c.time, results.c.id))
+    delete = leaderboard.delete()
+
+    if keys is not None:
+        best = best.where(tuple_(*[results.c[name] for name in LEADERBOARD_KEY]).in_(keys))
+        delete = delete.where(tuple_(*[leaderboard.c[name] for name in LEADERBOARD_KEY]).in_(keys))
+
+    connection.execute(delete)
+
+    upsert = pg_insert(leaderboard).from_select(
+        [*LEADERBOARD_KEY, 'gender', 'time', 'result_id', 'meet_id'], best)
+    connection.execute(upsert.on_conflict_do_update(
+        index_elements=list(LEADERBOARD_KEY),
+        set_={name: upsert.excluded[name] for name in ['gender', 'time', 'result_id', 'meet_id']}))
+
+
+def refresh_meet_leaderboard(connection, meet_id):
+    """Recomputes the leaderboard entries affected by the results of a meet
+    """
+    results = Result.__table__
+    keys = (select([results.c[name] for name in LEADERBOARD_KEY])
+            .where(results.c.meet_id == meet_id)
+            .distinct())
+    refresh_leaderboard(connection, keys)
+
+
+def _leaderboard_keys(result):
+    state = inspect(result)
+    current = tuple(getattr(result, name) for name in LEADERBOARD_KEY)
+    previous = tuple(
+        state.attrs[name].history.deleted[0] if state.attrs[name].history.deleted else value
+        for name, value in zip(LEADERBOARD_KEY, current))
+    return {current, previous}
+
+
+@event.listens_for(db.session, 'after_flush')
+def maintain_leaderboard(session, flush_context):
+    """Keeps the leaderboard in step with results flushed through the ORM
+    """
+    keys = set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Result):
+            keys.update(_leaderboard_keys(obj))
+        elif isinstance(obj, Swimmer) and obj in session.dirty \
+                and inspect(obj).attrs.gender.history.has_changes():
+            session.connection().execute(
+                LeaderboardEntry.__table__.update()
+                .where(LeaderboardEntry.__table__.c.swimmer_id == obj.id)
+                .values(gender=obj.gender))
+    refresh_leaderboard(session.connection(), keys)
@@ -0,0 +1,90 @@
+import os
+import base64
+import json
+from flask import request, abort
+from sqlalchemy import tuple_
+
+
+PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 100))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 1000))
+
+
+def encode_cursor(values):
+    """Encodes the key of the last row of a page as an opaque cursor
+
+    Values that are not JSON types, e.g. dates, are encoded as strings,
+    which cursor_value converts back.
+    """
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Decodes a cursor created by encode_cursor, aborts with 400 if it is invalid
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        abort(400)
+    if not isinstance(values, list):
+        abort(400)
+    return values
+
+
+def get_page_size():
+    """Returns the requested page size, capped at MAX_PAGE_SIZE
+    """
+    limit = request.args.get('limit', PAGE_SIZE)
+    try:
+        limit = int(limit)
+    except ValueError:
+        abort(400)
+    if limit < 1:
+        abort(400)
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def cursor_value(column, value):
+    """Converts a value decoded from a cursor back to the type of its column
+
+    Drivers with typed parameters, like asyncpg, do not accept a string
+    for a date column. Aborts with 400 if the value does not fit.
+    """
+    python_type = column.type.python_type
+    if isinstance(value, python_type):
+        return value
+    try:
+        if hasattr(python_type, 'fromisoformat'):
+            return python_type.fromisoformat(value)
+        return python_type(value)
+    except (TypeError, ValueError):
+        abort(400)
+
+
+def paginate(query, *columns):
+    """Yields the query of one page and returns the page and the cursor of the next page
+
+    For views decorated with read_view:
+
+        items, cursor = yield from paginate(query, Swimmer.id)
+
+    The query is ordered by the given columns, which together must be unique,
+    and continues after the row encoded in the `after` request argument.
+    The cursor is None on the last page.
+    """
+    limit = get_page_size()
+
+    after = request.args.get('after')
+    if after:
+        values = decode_cursor(after)
+        if len(values) != len(columns):
+            abort(400)
+        values = [cursor_value(column, value) for column, value in zip(columns, values)]
+        query = query.filter(tuple_(*columns) > tuple_(*values))
+
+    items = yield query.order_by(*columns).limit(limit + 1)
+
+    cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        cursor = encode_cursor([getattr(items[-1], column.key) for column in columns])
+    return items, cursor
@@ -0,0 +1,154 @@
+from flask import request, abort
+from sqlalchemy import func, tuple_
+
+from models import db, format_time, Swimmer, Meet, Result, LeaderboardEntry
+from serializers import RESULT_COLUMNS
+from pagination import encode_cursor, decode_cursor
+
+
+def personal_bests(swimmer_id):
+    """Returns a query of the fastest result of a swimmer per stroke, distance and course
+    """
+    return (db.session.query(*RESULT_COLUMNS)
+            .filter(Result.swimmer_id == swimmer_id)
+            .distinct(Result.stroke, Result.distance, Result.course)
+            .order_by(Result.stroke, Result.distance, Result.course, Result.time, Result.id))
+
+
+def rankings(stroke, distance, course, gender=None, season=None, limit=100, after=None):
+    """Returns a query of the fastest swimmers of an event with their best time, fastest first
+
+    All-time rankings are read from the leaderboard, rankings of a season
+    are computed from the results of that season. Rankings are ordered by
+    time and result id and continue after the (time, result id) given as
+    after; their rank then counts from there, see rankings_page.
+    """
+    if season is None:
+        return leaderboard_rankings(stroke, distance, course, gender=gender, limit=limit, after=after)
+    return season_rankings(stroke, distance, course, season, gender=gender, limit=limit, after=after)
+
+
+def leaderboard_rankings(stroke, distance, course, gender=None, limit=100, after=None):
+    """Returns a query of the top of the leaderboard of an event
+
+    The subquery walks the leaderboard index in time order and stops after
+    `limit` entries, so its cost depends on the page size only.
+    """
+    top = (db.session.query(
+               func.rank().over(order_by=LeaderboardEntry.time).label('rank'),
+               LeaderboardEntry.result_id,
+               LeaderboardEntry.time,
+               LeaderboardEntry.swimmer_id,
+               LeaderboardEntry.meet_id)
+           .filter(LeaderboardEntry.stroke == stroke,
+                   LeaderboardEntry.distance == distance,
+                   LeaderboardEntry.course == course))
+    if gender is not None:
+        top = top.filter(LeaderboardEntry.gender == gender)
+    if after is not None:
+        top = top.filter(tuple_(LeaderboardEntry.time, LeaderboardEntry.result_id) > tuple_(*after))
+    top = (top.order_by(LeaderboardEntry.time, LeaderboardEntry.result_id)
+           .limit(limit)
+           .subquery())
+
+    return (db.session.query(
+                top.c.rank,
+                top.c.result_id,
+                top.c.time,
+                Swimmer.id.label('swimmer_id'),
+                Swimmer.first_name,
+                Swimmer.last_name,
+                Swimmer.birth_year,
+                Meet.id.label('meet_id'),
+                Meet.name.label('meet_name'))
+            .join(Swimmer, Swimmer.id == top.c.swimmer_id)
+            .join(Meet, Meet.id == top.c.meet_id)
+            .order_by(top.c.time, top.c.result_id))
+
+
+def season_rankings(stroke, distance, course, season, gender=None, limit=100, after=None):
+    """Returns a query of the fastest swimmers of an event in a season
+
+    The best result per swimmer is picked with DISTINCT ON in a subquery,
+    which the outer query ranks, joins with swimmers and meets and limits.
+    Filtering on the season of the results reads their partition only.
+    """
+    best = (db.session.query(Result.id, Result.swimmer_id, Result.meet_id, Result.time)
+            .filter(Result.season == season,
+                    Result.stroke == stroke,
+                    Result.distance == distance,
+                    Result.course == course))
+    if gender is not None:
+        best = (best.join(Swimmer, Result.swimmer_id == Swimmer.id)
+                .filter(Swimmer.gender == gender))
+    best = (best.distinct(Result.swimmer_id)
+            .order_by(Result.swimmer_id, Result.time, Result.id)
+            .subquery())
+
+    query = db.session.query(
+        func.rank().over(order_by=best.c.time).label('rank'),
+        best.c.id.label('result_id'),
+        best.c.time,
+        Swimmer.id.label('swimmer_id'),
+        Swimmer.first_name,
+        Swimmer.last_name,
+        Swimmer.birth_year,
+        Meet.id.label('meet_id'),
+        Meet.name.label('meet_name'))
+    if after is not None:
+        query = query.filter(tuple_(best.c.time, best.c.id) > tuple_(*after))
+    return (query.join(Swimmer, Swimmer.id == best.c.swimmer_id)
+            .join(Meet, Meet.id == best.c.meet_id)
+            .order_by(best.c.time, best.c.id)
+            .limit(limit))
+
+
+def get_rankings_cursor():
+    """Returns the cursor given in the `after` request argument as (time, result id, rank, position) or None
+
+    Aborts with 400 if it is invalid.
+    """
+    after = request.args.get('after')
+    if not after:
+        return None
+    values = decode_cursor(after)
+    if len(values) != 4 or not all(type(value) is int for value in values):
+        abort(400)
+    return values
+
+
+def rankings_page(rows, limit, after=None):
+    """Returns a page of rankings with their overall ranks and the cursor of the next page
+
+    rows are up to limit + 1 rows of rankings. On later pages their rank
+    only counts the rows of the page. Rows tied with the last ranking of the
+    previous page share its rank, later ones rank after all rankings before
+    the page, whose number the cursor carries as position.
+    """
+    page = rows[:limit]
+    if after is None:
+        ranks = [row.rank for row in page]
+    else:
+        time, _, rank, position = after
+        ranks = [rank if row.time == time else position + row.rank for row in page]
+
+    cursor = None
+    if len(rows) > limit:
+        position = (after[3] if after is not None else 0) + limit
+        cursor = encode_cursor([page[-1].time, page[-1].result_id, ranks[-1], position])
+    return page, ranks, cursor
+
+
+def format_ranking(row, rank):
+    # keys in sorted order, see serializers.encode
+    return {
+        'first name': row.first_name,
+        'last name': row.last_name,
+        'meet name': row.meet_name,
+        'meet_id': row.meet_id,
+        'rank': rank,
+        'result id': row.result_id,
+        'swimmer id': row.swimmer_id,
+        'time': format_time(row.time),
+        'year of birth': row.birth_year
+    }
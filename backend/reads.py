@@ -0,0 +1,42 @@
+import inspect
+from functools import wraps
+
+from timing import timed
+
+
+def advance(steps, rows=None):
+    """Runs a read view until it needs the rows of its next query
+
+    Returns (query, None) while the view yields queries and (None, response)
+    once it returns its response.
+    """
+    try:
+        return steps.send(rows), None
+    except StopIteration as stop:
+        return None, stop.value
+
+
+def read_view(f):
+    """Runs a view that yields its queries and gets back their rows
+
+        rows = yield db.session.query(*MEET_COLUMNS).filter(Meet.id == meet_id)
+
+    Flask runs the queries on the session. The ASGI app in asgi.py runs the
+    same view with the queries awaited on an async connection, so both
+    serve the route from one definition. Views must not execute queries
+    themselves, and may return a response without yielding.
+    """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        steps = f(*args, **kwargs)
+        if not inspect.isgenerator(steps):
+            return steps
+        query, response = advance(steps)
+        while query is not None:
+            rows = query.all()
+            # mostly formatting and encoding, the view only builds queries besides
+            with timed('serialize'):
+                query, response = advance(steps, rows)
+        return response
+    wrapper.read_steps = f
+    return wrapper
@@ -0,0 +1,88 @@
+import hashlib
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+from cache import LRUBackend, RedisBackend, RESPONSE_CACHE, REDIS_URL
+from models import db, DB_REPLICA_PIN_SECONDS
+
+
+READ_METHODS = ('GET', 'HEAD')
+
+
+class WriterPins:
+    """Clients that wrote recently, which read from the primary until their pin expires
+
+    Clients are told apart by a hash of their Authorization header. Pins
+    are kept in a cache backend, with redis a write pins the client on
+    all workers.
+    """
+    def __init__(self, backend, seconds=DB_REPLICA_PIN_SECONDS):
+        self.backend = backend
+        self.seconds = seconds
+
+    def pin(self, client):
+        self.backend.set(f'pin:{client}', b'1', ttl=self.seconds)
+
+    def is_pinned(self, client):
+        return self.backend.get_many([f'pin:{client}'])[0] is not None
+
+
+pins = None
+
+
+def client_key(headers):
+    authorization = headers.get('Authorization')
+    if not authorization:
+        return None
+    return hashlib.sha256(authorization.encode()).hexdigest()
+
+
+def reads_from_replica(view, method, headers):
+    """Checks if a request may read from a replica
+
+    That is a GET of a view requiring a get: permission, by a client that
+    did not write within the last DB_REPLICA_PIN_SECONDS.
+    """
+    if pins is None or method not in READ_METHODS \
+            or not getattr(view, 'permission', '').startswith('get:'):
+        return False
+    client = client_key(headers)
+    return client is not None and not pins.is_pinned(client)
+
+
+def _route_request():
+    view = current_app.view_functions.get(request.endpoint)
+    g.read_replica = reads_from_replica(view, request.method, request.headers)
+
+
+def _pin_writer(session):
+    if pins is None or not has_request_context() or request.method in READ_METHODS:
+        return
+    client = client_key(request.headers)
+    if client is not None:
+        pins.pin(client)
+
+
+def setup_replicas(app, backend=RESPONSE_CACHE):
+    """Routes read-only requests to the read replicas passed to setup_db
+
+    Every commit in a request that writes pins its client to the primary
+    for DB_REPLICA_PIN_SECONDS. Does nothing if no replicas are configured.
+    """
+    global pins
+
+    if 'replicas' not in app.extensions:
+        pins = None
+        return
+
+    if backend == 'redis':
+        pins = WriterPins(RedisBackend.from_url(REDIS_URL))
+    elif isinstance(backend, (LRUBackend, RedisBackend)):
+        pins = WriterPins(backend)
+    else:
+        pins = WriterPins(LRUBackend())
+
+    if _route_request not in app.before_request_funcs.get(None, []):
+        app.before_request(_route_request)
+    if not event.contains(db.session, 'after_commit', _pin_writer):
+        event.listen(db.session, 'after_commit', _pin_writer)
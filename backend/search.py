@@ -0,0 +1,47 @@
+import os
+from flask import request, abort
+from sqlalchemy import func, literal
+
+
+# matches GET /search returns per kind unless ?limit= asks for fewer or more, up to MAX_SEARCH_LIMIT
+SEARCH_LIMIT = int(os.environ.get('SEARCH_LIMIT', 10))
+MAX_SEARCH_LIMIT = int(os.environ.get('MAX_SEARCH_LIMIT', 50))
+MAX_SEARCH_LENGTH = 100
+
+
+def get_search_arg(name='q'):
+    """Returns the search term lowercased and with runs of whitespace collapsed
+
+    Aborts with 400 if it is missing, blank or longer than MAX_SEARCH_LENGTH.
+    """
+    value = ' '.join(request.args.get(name, '').lower().split())
+    if not value or len(value) > MAX_SEARCH_LENGTH:
+        abort(400)
+    return value
+
+
+def get_search_limit():
+    limit = request.args.get('limit', SEARCH_LIMIT)
+    try:
+        limit = int(limit)
+    except ValueError:
+        abort(400)
+    if limit < 1:
+        abort(400)
+    return min(limit, MAX_SEARCH_LIMIT)
+
+
+def search(query, text, key, term, limit):
+    """Filters a query to the rows whose text matches the term, best matches first
+
+    A row matches if the term is similar to some run of words in its text
+    (the <% operator of pg_trgm), so prefixes and misspellings match too,
+    and the trigram index on the text serves the filter. Matches are
+    ranked by that word similarity, then by the similarity to the whole
+    text, which puts shorter texts first, then by key.
+    """
+    term = literal(term)
+    # the operator is <%, with the percent sign escaped for the pyformat parameters of psycopg2 and databases
+    return (query.filter(term.op('<%%')(text))
+            .order_by(func.word_similarity(term, text).desc(), func.similarity(term, text).desc(), key)
+            .limit(limit))
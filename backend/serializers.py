@@ -0,0 +1,90 @@
+import json
+from functools import lru_cache
+from flask import current_app, jsonify
+from werkzeug.http import http_date
+
+from models import format_time, Swimmer, Meet, Result
+
+
+# columns of the format() methods, for queries that skip building model objects
+SWIMMER_COLUMNS = (Swimmer.id, Swimmer.gender, Swimmer.first_name, Swimmer.last_name,
+                   Swimmer.birth_year)
+MEET_COLUMNS = (Meet.id, Meet.name, Meet.start_date, Meet.end_date, Meet.city, Meet.country)
+RESULT_COLUMNS = (Result.id, Result.swimmer_id, Result.meet_id, Result.course,
+                  Result.distance, Result.stroke, Result.time)
+
+
+@lru_cache(maxsize=4096)
+def format_date(date):
+    """Formats a date like Flask's JSON encoder does
+    """
+    return http_date(date.timetuple())
+
+
+# The formatters build their dictionaries with the keys in sorted order and
+# with JSON values only, so encode() can skip key sorting and the encoder's
+# default() hook and still produce the same bytes as jsonify.
+
+def format_swimmer(row):
+    """Formats a row of SWIMMER_COLUMNS like Swimmer.format
+    """
+    return {
+        'first name': row.first_name,
+        'gender': row.gender,
+        'id': row.id,
+        'last name': row.last_name,
+        'year of birth': row.birth_year
+    }
+
+
+def format_meet(row):
+    """Formats a row of MEET_COLUMNS like Meet.format
+    """
+    return {
+        'city': row.city,
+        'country': row.country,
+        'end date': format_date(row.end_date),
+        'id': row.id,
+        'name': row.name,
+        'start date': format_date(row.start_date)
+    }
+
+
+def format_result(row):
+    """Formats a row of RESULT_COLUMNS like Result.format
+    """
+    return {
+        'course': row.course,
+        'distance': row.distance,
+        'id': row.id,
+        'meet_id': row.meet_id,
+        'stroke': row.stroke,
+        'swimmer id': row.swimmer_id,
+        'time': format_time(row.time)
+    }
+
+
+_encoder = json.JSONEncoder(ensure_ascii=True, separators=(',', ':'))
+
+
+def encode(data):
+    """Encodes data built from the formatters above as compact JSON
+
+    The dictionaries of data must have their keys in sorted order.
+    """
+    return _encoder.encode(data)
+
+
+def json_response(data):
+    """Returns data as JSON response, byte-identical to jsonify(data)
+
+    Top-level keys are sorted here, nested dictionaries must come from the
+    formatters above. Falls back to jsonify when the app pretty-prints JSON
+    or does not sort keys.
+    """
+    config = current_app.config
+    if config['JSONIFY_PRETTYPRINT_REGULAR'] or current_app.debug \
+            or not config['JSON_SORT_KEYS'] or not config['JSON_AS_ASCII']:
+        return jsonify(data)
+    body = encode({key: data[key] for key in sorted(data)}) + '\n'
+    return current_app.response_class(body, mimetype=config['JSONIFY_MIMETYPE'])
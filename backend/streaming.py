@@ -0,0 +1,38 @@
+import os
+from flask import Response, request, stream_with_context
+
+from serializers import encode
+
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+# rows fetched per round trip from the server-side cursor
+STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', 1000))
+
+
+def wants_stream():
+    """Checks if the client asked for a streamed NDJSON response
+    """
+    if request.args.get('stream') == '1':
+        return True
+    best = request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+def ndjson_response(query, serialize):
+    """Streams all rows of a query as newline delimited JSON
+
+    Rows are read from a server-side cursor in batches of STREAM_BATCH_SIZE
+    and written out one batch per chunk, so memory use does not depend on
+    the number of rows.
+    """
+    def generate():
+        lines = []
+        for row in query.yield_per(STREAM_BATCH_SIZE):
+            lines.append(encode(serialize(row)))
+            if len(lines) >= STREAM_BATCH_SIZE:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+        if lines:
+            yield '\n'.join(lines) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
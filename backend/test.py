@@ -2,25 +2,50 @@ import os
 import unittest
 import http
 import json
+import base64
+import sqlite3
+import datetime
+import gzip
+import io
+import csv
+import tempfile
+import time
+import asyncio
+from collections import namedtuple
+from contextlib import contextmanager
+from flask import Flask, g, jsonify
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, exc
+from prometheus_client import REGISTRY
+from asyncpg.exceptions import ConnectionDoesNotExistError
+from starlette.testclient import TestClient
+import pyarrow.parquet as pq
 
 from app import app
-from models import Swimmer, Meet, Result
+from models import db, format_time, parse_time, Swimmer, Meet, Result
+from auth import JWKSCache, TokenCache, token_cache, use_key_set
+from local_jwt import LocalIssuer
+import cache
+import compression
+from cache import LRUBackend, RedisBackend, ResponseCache, cached
+from live import Broker
+from reads import read_view
+from filters import filter_results, lookup_ids, MAX_BATCH_IDS
+from serializers import RESULT_COLUMNS
+from rankings import rankings
+from models import TimedQueuePool, ReplicaSet
+import replicas
+from replicas import WriterPins
+import asgi
 
 AUTH0_DOMAIN = os.environ.get('AUTH0_DOMAIN', 'fsnd-ritterjul.eu.auth0.com')
 API_AUDIENCE = os.environ.get('API_AUDIENCE', 'swimresults')
-# configuration of test application with all permissions
-CLIENT_ID = os.environ['TEST_CLIENT_ID']
-CLIENT_SECRET = os.environ['TEST_CLIENT_SECRET']
-# configuration of test application with permissions of role Swimmer
-SWIMMER_CLIENT_ID = os.environ['TEST_SWIMMER_CLIENT_ID']
-SWIMMER_CLIENT_SECRET = os.environ['TEST_SWIMMER_CLIENT_SECRET']
-# configuration of test application with permissions of role Swimmer
-COACH_CLIENT_ID = os.environ['TEST_COACH_CLIENT_ID']
-COACH_CLIENT_SECRET = os.environ['TEST_COACH_CLIENT_SECRET']
-# configuration of test application with permissions of role Swimmer
-OFFICIAL_CLIENT_ID = os.environ['TEST_OFFICIAL_CLIENT_ID']
-OFFICIAL_CLIENT_SECRET = os.environ['TEST_OFFICIAL_CLIENT_SECRET']
+# 1 requests tokens from the test applications in Auth0 configured with
+# TEST_CLIENT_ID, TEST_SWIMMER_CLIENT_ID, TEST_COACH_CLIENT_ID and TEST_OFFICIAL_CLIENT_ID
+# and their secrets, by default tokens are signed locally without network access
+TEST_AUTH0 = os.environ.get('TEST_AUTH0') == '1'
+# test applications in Auth0 with all permissions and with those of the roles Swimmer, Coach and Official
+TEST_CLIENTS = ['TEST', 'TEST_SWIMMER', 'TEST_COACH', 'TEST_OFFICIAL']
 
 def getToken(id, secret):
     conn = http.client.HTTPSConnection(AUTH0_DOMAIN)
@@ -43,6 +68,19 @@ def getToken(id, secret):
     return json.loads(data.decode('utf-8'))['access_token']
 
 
+def getTokens():
+    """Returns tokens with all permissions and with those of the roles Swimmer, Coach and Official"""
+    if TEST_AUTH0:
+        return [getToken(os.environ[f'{client}_CLIENT_ID'], os.environ[f'{client}_CLIENT_SECRET'])
+                for client in TEST_CLIENTS]
+    issuer = LocalIssuer(bits=1024)
+    use_key_set(issuer.jwks())
+    return [issuer.mint_role(role) for role in ['all', 'swimmer', 'coach', 'official']]
+
+
+TOKENS = getTokens()
+
+
 class SwimResultsTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -51,15 +89,82 @@ class SwimResultsTestCase(unittest.TestCase):
 
         self.client = self.app.test_client
 
-        self.token = getToken(CLIENT_ID, CLIENT_SECRET)
-        self.swimmer_token = getToken(SWIMMER_CLIENT_ID, SWIMMER_CLIENT_SECRET)
-        self.coach_token = getToken(COACH_CLIENT_ID, COACH_CLIENT_SECRET)
-        self.official_token = getToken(OFFICIAL_CLIENT_ID, OFFICIAL_CLIENT_SECRET)
+        self.token, self.swimmer_token, self.coach_token, self.official_token = TOKENS
 
     def tearDown(self):
         """Executed after each test"""
         pass
 
+    @contextmanager
+    def count_statements(self):
+        """Collects the SQL statements executed inside the block"""
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with self.app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+    @contextmanager
+    def without_response_cache(self):
+        """Serves all requests inside the block from the database"""
+        response_cache, cache.response_cache = cache.response_cache, None
+        try:
+            yield
+        finally:
+            cache.response_cache = response_cache
+
+    def explain(self, url, make_query):
+        """Returns the plan of the query built for a request to url
+
+        Sequential scans are disabled, as they beat any index on the tiny
+        tables of the fixture.
+        """
+        with self.app.test_request_context(url):
+            db.session.execute('SET LOCAL enable_seqscan = off')
+            statement = make_query().statement.compile(dialect=db.engine.dialect,
+                                                       compile_kwargs={'literal_binds': True})
+            plan = '\n'.join(row[0] for row in db.session.execute(f'EXPLAIN {statement}'))
+            db.session.rollback()
+        return plan
+
+    def add_meet(self, start_date, results):
+        """Adds a meet with results (swimmer id, course, distance, stroke, time), deleted after the test
+
+        Returns the ids of the meet and of its results.
+        """
+        with self.app.app_context():
+            meet = Meet(name='Test Meet', start_date=start_date, end_date=start_date,
+                        city='Berlin', country='Germany')
+            meet.insert()
+            results = [Result(swimmer_id=swimmer_id, meet_id=meet.id, course=course, distance=distance,
+                              stroke=stroke, time=parse_time(time))
+                       for swimmer_id, course, distance, stroke, time in results]
+            db.session.add_all(results)
+            db.session.commit()
+            meet_id, result_ids = meet.id, [result.id for result in results]
+        self.addCleanup(self.delete_meet, meet_id)
+        return meet_id, result_ids
+
+    def delete_meet(self, meet_id):
+        with self.app.app_context():
+            Meet.query.get(meet_id).delete()
+
+    def assertStatementCount(self, url, count):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        # the first request of a test may connect and initialize the dialect
+        self.client().get('/swimmers?limit=1', headers=headers)
+        with self.without_response_cache(), self.count_statements() as statements:
+            res = self.client().get(url, headers=headers)
+        self.assertIn(res.status_code, (200, 404))
+        self.assertEqual(len(statements), count, statements)
+
     '''
     Test endpoints for success and error handling
     '''
@@ -80,6 +185,39 @@ class SwimResultsTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 401)
         self.assertFalse(data['success'])
 
+    def test_get_swimmers_by_ids(self):
+        headers = {
+            'Authorization': f'Bearer {self.token}',
+            'Content-Type': 'application/json'
+        }
+        # a swimmer of its own, the fixture swimmer 155848 is deleted by test_delete_swimmer
+        payload = {'gender': 'F', 'first name': 'Melina', 'last name': 'Mattis', 'year of birth': 1994}
+        swimmer_id = json.loads(self.client().post('/swimmers', data=json.dumps(payload), headers=headers).data)['id']
+        self.addCleanup(self.client().delete, f'/swimmers/{swimmer_id}', headers=headers)
+        res = self.client().get(f'/swimmers?ids={swimmer_id},1000000,155849,{swimmer_id}', headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([swimmer['id'] for swimmer in data['swimmers']], [swimmer_id, 155849])
+        self.assertEqual(data['missing'], [1000000])
+
+    def test_get_meets_by_too_many_ids(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        ids = ','.join(str(meet_id) for meet_id in range(MAX_BATCH_IDS + 1))
+        res = self.client().get(f'/meets?ids={ids}', headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_get_swimmers_invalid_token(self):
+        headers = {'Authorization': 'Bearer not-a-token'}
+        res = self.client().get('/swimmers', headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 401)
+        self.assertFalse(data['success'])
+
     def test_create_swimmer(self):
         payload = {
             'id': 155847,
@@ -151,6 +289,25 @@ class SwimResultsTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 404)
         self.assertFalse(data['success'])
 
+    def test_get_swimmer_personal_bests(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        res = self.client().get('/swimmers/155849/personal-bests', headers=headers)
+        data = json.loads(res.data)
+        events = [(result['stroke'], result['distance'], result['course']) for result in data['personal bests']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertTrue(len(events))
+        self.assertEqual(len(events), len(set(events)))
+
+    def test_get_swimmer_personal_bests_invalid_id(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        res = self.client().get('/swimmers/1000000/personal-bests', headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertFalse(data['success'])
+
     def test_edit_swimmer(self):
         payload = {
             'year of birth': 1995
@@ -253,6 +410,112 @@ class SwimResultsTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 400)
         self.assertFalse(data['success'])
 
+    def test_create_meet_results(self):
+        payload = [
+            {'swimmer id': 155849, 'course': 'LCM', 'distance': 100, 'stroke': 'Free', 'time': '1:01.23'},
+            {'swimmer id': 155849, 'course': 'LCM', 'distance': 100, 'stroke': 'Fly', 'time': '1:09.87'}
+        ]
+        headers = {
+            'Authorization': f'Bearer {self.token}',
+            'Content-Type': 'application/json'
+        }
+        res = self.client().post('/meets/1/results:bulk', data=json.dumps(payload), headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(len(data['ids']), 2)
+        self.assertEqual(data['errors'], [])
+
+    def test_create_meet_results_non_integer(self):
+        payload = [
+            {'swimmer id': 155849.7, 'course': 'LCM', 'distance': 100, 'stroke': 'Back', 'time': '1:12.40'},
+            {'swimmer id': True, 'course': 'LCM', 'distance': 100, 'stroke': 'Back', 'time': '1:12.40'},
+            {'swimmer id': '155849', 'course': 'LCM', 'distance': 100, 'stroke': 'Back', 'time': '1:12.40'},
+            {'swimmer id': 155849, 'course': 'LCM', 'distance': 100.0, 'stroke': 'Back', 'time': '1:12.40'}
+        ]
+        headers = {
+            'Authorization': f'Bearer {self.token}',
+            'Content-Type': 'application/json'
+        }
+        res = self.client().post('/meets/1/results:bulk', data=json.dumps(payload), headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual([error['row'] for error in data['errors']], [0, 1, 2, 3])
+
+    def test_create_meet_results_csv_non_integer(self):
+        payload = 'swimmer id,course,distance,stroke,time\n155849,SCM,0200,IM,2:35.12\n'
+        headers = {
+            'Authorization': f'Bearer {self.token}',
+            'Content-Type': 'text/csv'
+        }
+        res = self.client().post('/meets/1/results:bulk', data=payload, headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual([error['row'] for error in data['errors']], [0])
+
+    def test_create_meet_results_csv(self):
+        payload = 'swimmer id,course,distance,stroke,time\n155849,SCM,200,IM,2:35.12\n'
+        headers = {
+            'Authorization': f'Bearer {self.token}',
+            'Content-Type': 'text/csv'
+        }
+        res = self.client().post('/meets/1/results:bulk', data=payload, headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(len(data['ids']), 1)
+
+    def test_create_meet_results_invalid_row(self):
+        payload = [
+            {'swimmer id': 155849, 'course': 'LCM', 'distance': 100, 'stroke': 'Back', 'time': '1:12.40'},
+            {'swimmer id': 155849, 'course': 'LCM', 'distance': 33, 'stroke': 'Back', 'time': '0:30.00'}
+        ]
+        headers = {
+            'Authorization': f'Bearer {self.token}',
+            'Content-Type': 'application/json'
+        }
+        res = self.client().post('/meets/1/results:bulk', data=json.dumps(payload), headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data['success'])
+        self.assertEqual([error['row'] for error in data['errors']], [1])
+
+    def test_create_meet_results_partial(self):
+        payload = [
+            {'swimmer id': 155849, 'course': 'LCM', 'distance': 100, 'stroke': 'Back', 'time': '1:12.40'},
+            {'swimmer id': 1000000, 'course': 'LCM', 'distance': 100, 'stroke': 'Back', 'time': '1:10.00'}
+        ]
+        headers = {
+            'Authorization': f'Bearer {self.token}',
+            'Content-Type': 'application/json'
+        }
+        res = self.client().post('/meets/1/results:bulk?partial=1', data=json.dumps(payload), headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(len(data['ids']), 1)
+        self.assertEqual([error['row'] for error in data['errors']], [1])
+
+    def test_create_meet_results_invalid_id(self):
+        payload = [
+            {'swimmer id': 155849, 'course': 'LCM', 'distance': 100, 'stroke': 'Back', 'time': '1:12.40'}
+        ]
+        headers = {
+            'Authorization': f'Bearer {self.token}',
+            'Content-Type': 'application/json'
+        }
+        res = self.client().post('/meets/1000000/results:bulk', data=json.dumps(payload), headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertFalse(data['success'])
+
     def test_get_meet_details(self):
         headers = {'Authorization': f'Bearer {self.token}'}
         res = self.client().get('/meets/1', headers=headers)
@@ -342,6 +605,193 @@ class SwimResultsTestCase(unittest.TestCase):
         self.assertTrue(data['success'])
         self.assertTrue(len(data['results']))
 
+    def test_get_results_paginated(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        res = self.client().get('/results?limit=1', headers = headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['results']), 1)
+        self.assertTrue(data['next'])
+
+        res = self.client().get(f'/results?limit=1&after={data["next"]}', headers = headers)
+        next_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertGreater(next_data['results'][0]['id'], data['results'][0]['id'])
+
+    def test_get_results_invalid_cursor(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        res = self.client().get('/results?after=invalid', headers = headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_get_results_invalid_cursor_value(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        cursor = base64.urlsafe_b64encode(b'["fast", 1]').decode()
+        res = self.client().get(f'/results?sort=time&after={cursor}', headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_get_results_stream(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        res = self.client().get('/results?stream=1', headers = headers)
+        rows = [json.loads(line) for line in res.data.splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertTrue(len(rows))
+        self.assertIn('time', rows[0])
+
+    def test_get_results_stream_accept_header(self):
+        headers = {
+            'Authorization': f'Bearer {self.token}',
+            'Accept': 'application/x-ndjson'
+        }
+        res = self.client().get('/results', headers = headers)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+
+    def test_export_results_csv(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        results = json.loads(self.client().get('/meets/1/results', headers=headers).data)['results']
+        res = self.client().get('/export/results?format=csv&meet_id=1', headers=headers)
+        rows = list(csv.DictReader(io.StringIO(res.data.decode())))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'text/csv')
+        self.assertEqual(len(rows), len(results))
+        self.assertEqual(list(rows[0]), ['id', 'swimmer_id', 'meet_id', 'course', 'distance', 'stroke', 'time_ms'])
+
+    def test_export_results_parquet(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        results = json.loads(self.client().get('/meets/1/results', headers=headers).data)['results']
+        res = self.client().get('/export/results?format=parquet&meet_id=1', headers=headers)
+        table = pq.read_table(io.BytesIO(res.data))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(table.num_rows, len(results))
+        self.assertEqual(str(table.schema.field('time').type), 'duration[ms]')
+        self.assertEqual(table.column('id').to_pylist(), [result['id'] for result in results])
+
+    def test_export_results_invalid_format(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        res = self.client().get('/export/results?format=xlsx', headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_search(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        res = self.client().get('/search?q=Ritt', headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual([swimmer['id'] for swimmer in data['swimmers']], [155849])
+        self.assertEqual(data['meets'], [])
+
+    def test_search_misspelled(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        res = self.client().get('/search?q=lochnr%20cup&limit=1', headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([meet['id'] for meet in data['meets']], [1])
+
+    def test_search_without_meets_permission(self):
+        token = 'swimmers-only'
+        token_cache.put(token, {'permissions': ['get:swimmers'], 'exp': time.time() + 60})
+        res = self.client().get('/search?q=Ritt', headers={'Authorization': f'Bearer {token}'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 403)
+        self.assertFalse(data['success'])
+
+    def test_search_without_term(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        res = self.client().get('/search?q=%20', headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_get_results_filtered(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        res = self.client().get('/results?stroke=Breast&gender=F&date_to=31.12.2003&sort=time', headers = headers)
+        data = json.loads(res.data)
+        times = [parse_time(result['time']) for result in data['results']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(len(data['results']))
+        self.assertTrue(all(result['stroke'] == 'Breast' for result in data['results']))
+        self.assertEqual(times, sorted(times))
+
+    def test_get_results_filtered_uses_event_index(self):
+        def filtered():
+            query, order = filter_results(db.session.query(*RESULT_COLUMNS))
+            return query.order_by(*order).limit(10)
+
+        plan = self.explain('/results?stroke=Breast&distance=50&course=LCM&sort=time', filtered)
+
+        # on partitions the index is named results_<season>_stroke_distance_course_time_id_idx
+        self.assertIn('stroke_distance_course_time', plan)
+        self.assertNotIn('Seq Scan', plan)
+
+    def test_get_results_time_range(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        # only results of swimmer 155849, who is not deleted by any test
+        res = self.client().get('/results?time_from=48.00&time_to=0:50.25&sort=time', headers = headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([result['time'] for result in data['results']], ['0:48.41', '0:50.25'])
+
+    def test_get_results_invalid_time_range(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        res = self.client().get('/results?time_from=1:75.00', headers = headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_get_results_season(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        _, result_ids = self.add_meet(datetime.date(1999, 10, 23), [(155849, 'SCM', 100, 'Breast', '1:41.03')])
+        res = self.client().get('/results?season=1999', headers = headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([result['id'] for result in data['results']], result_ids)
+
+    def test_edit_meet_moves_results_to_season(self):
+        headers = {
+            'Authorization': f'Bearer {self.token}',
+            'Content-Type': 'application/json'
+        }
+        meet_id, result_ids = self.add_meet(datetime.date(1998, 10, 23), [(155849, 'SCM', 100, 'Breast', '1:41.03')])
+        res = self.client().patch(f'/meets/{meet_id}', data=json.dumps({'start date': '23.10.1997'}), headers=headers)
+        data = json.loads(self.client().get('/results?season=1997', headers=headers).data)
+        data_before = json.loads(self.client().get('/results?season=1998', headers=headers).data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([result['id'] for result in data['results']], result_ids)
+        self.assertEqual(data_before['results'], [])
+
+    def test_get_results_invalid_filter(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        res = self.client().get('/results?stroke=Butterfly', headers = headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data['success'])
+
     def test_get_results_unauthorized(self):
         res = self.client().get('/results')
         data = json.loads(res.data)
@@ -349,6 +799,224 @@ class SwimResultsTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 401)
         self.assertFalse(data['success'])
     
+    def test_get_rankings(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        res = self.client().get('/rankings?stroke=Free&distance=50&course=LCM&season=2003', headers=headers)
+        data = json.loads(res.data)
+        times = [parse_time(ranking['time']) for ranking in data['rankings']]
+        swimmers = [ranking['swimmer id'] for ranking in data['rankings']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertTrue(len(times))
+        self.assertEqual(times, sorted(times))
+        self.assertEqual(len(swimmers), len(set(swimmers)))
+        self.assertEqual(data['rankings'][0]['rank'], 1)
+
+    def test_get_rankings_leaderboard(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        res = self.client().get('/rankings?stroke=Back&distance=50&course=LCM', headers=headers)
+        data = json.loads(res.data)
+        res_season = self.client().get('/rankings?stroke=Back&distance=50&course=LCM&season=2003', headers=headers)
+        data_season = json.loads(res_season.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertTrue(len(data['rankings']))
+        # all fixture results of the event are from 2003, so the leaderboard must match the live query
+        self.assertEqual(data['rankings'], data_season['rankings'])
+
+    def test_season_rankings_scan_one_partition(self):
+        with self.app.app_context():
+            query = rankings('Free', 50, 'LCM', season=2003)
+            statement = query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True})
+            plan = '\n'.join(row[0] for row in db.session.execute(f'EXPLAIN {statement}'))
+
+        self.assertIn('results_2003', plan)
+        self.assertNotIn('results_2004', plan)
+
+    def test_get_rankings_pages(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        for url in ['/rankings?stroke=Free&distance=50&course=LCM&season=2003',
+                    '/rankings?stroke=Back&distance=50&course=LCM']:
+            everything = json.loads(self.client().get(url, headers=headers).data)
+            pages = []
+            data = json.loads(self.client().get(f'{url}&limit=1', headers=headers).data)
+            pages.append(data)
+            while data['next']:
+                data = json.loads(self.client().get(f'{url}&limit=1&after={data["next"]}', headers=headers).data)
+                pages.append(data)
+
+            self.assertEqual(len(pages), len(everything['rankings']))
+            self.assertEqual([ranking for page in pages for ranking in page['rankings']], everything['rankings'])
+
+    def test_get_rankings_invalid_cursor(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        cursor = base64.urlsafe_b64encode(b'[4750, 4]').decode()
+        res = self.client().get(f'/rankings?stroke=Back&distance=50&course=LCM&after={cursor}', headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_get_rankings_missing_event(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        res = self.client().get('/rankings?stroke=Free', headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data['success'])
+
+    def test_statement_count_swimmer_results(self):
+        self.assertStatementCount('/swimmers/155849/results', 1)
+        self.assertStatementCount('/swimmers/1000000/results', 1)
+
+    def test_statement_count_meet_results(self):
+        self.assertStatementCount('/meets/1/results', 1)
+        self.assertStatementCount('/meets/1000000/results', 1)
+
+    def test_statement_count_details(self):
+        self.assertStatementCount('/swimmers/155849', 1)
+        self.assertStatementCount('/meets/1', 1)
+
+    def test_statement_count_lists(self):
+        self.assertStatementCount('/swimmers', 1)
+        self.assertStatementCount('/meets', 1)
+        self.assertStatementCount('/results?stroke=Free&gender=F&date_from=01.01.2000', 1)
+
+    def test_statement_count_rankings(self):
+        self.assertStatementCount('/swimmers/155849/personal-bests', 1)
+        self.assertStatementCount('/rankings?stroke=Free&distance=50&course=LCM', 1)
+        self.assertStatementCount('/rankings?stroke=Free&distance=50&course=LCM&season=2003', 1)
+
+    def test_serialization_matches_format(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        with self.app.app_context():
+            swimmer = Swimmer.query.get(155849)
+            meet = Meet.query.get(1)
+            results = Result.query.filter(Result.meet_id == 1).order_by(Result.id).all()
+            expected = {
+                '/swimmers/155849': jsonify({'success': True, 'swimmer': swimmer.format()}).get_data(),
+                '/meets/1': jsonify({'success': True, 'meet': meet.format()}).get_data(),
+                '/meets/1/results': jsonify({'success': True, 'results': [result.format() for result in results]}).get_data()
+            }
+
+        for url, body in expected.items():
+            res = self.client().get(url, headers=headers)
+            self.assertEqual(res.data, body)
+
+    def test_cached_response_reflects_edit(self):
+        headers = {
+            'Authorization': f'Bearer {self.token}',
+            'Content-Type': 'application/json'
+        }
+        city = json.loads(self.client().get('/meets/1', headers=headers).data)['meet']['city']
+        self.addCleanup(self.client().patch, '/meets/1', data=json.dumps({'city': city}), headers=headers)
+        self.client().patch('/meets/1', data=json.dumps({'city': 'Potsdam'}), headers=headers)
+        res = self.client().get('/meets/1', headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['meet']['city'], 'Potsdam')
+
+    def test_get_meet_results_not_modified(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        etag = self.client().get('/meets/1/results', headers=headers).headers['ETag']
+        res = self.client().get('/meets/1/results', headers={**headers, 'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers['ETag'], etag)
+        self.assertEqual(res.data, b'')
+
+    def test_get_meet_results_modified(self):
+        headers = {
+            'Authorization': f'Bearer {self.token}',
+            'Content-Type': 'application/json'
+        }
+        etag = self.client().get('/meets/1/results', headers=headers).headers['ETag']
+        self.client().patch('/meets/1', data=json.dumps({'city': 'Berlin'}), headers=headers)
+        res = self.client().get('/meets/1/results', headers={**headers, 'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_stream_meet_results(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        res = self.client().get('/meets/1/results/stream', headers=headers, buffered=False)
+        snapshot = next(iter(res.response)).decode()
+        res.close()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'text/event-stream')
+        self.assertIn('event: result', snapshot)
+        self.assertIn('"meet_id":1', snapshot)
+
+    def test_stream_meet_results_invalid_id(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        res = self.client().get('/meets/1000000/results/stream', headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertFalse(data['success'])
+
+    def test_cached_response_unauthorized(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        self.client().get('/meets/1', headers=headers)
+        res = self.client().get('/meets/1')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 401)
+        self.assertFalse(data['success'])
+
+    def test_request_timing(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        labels = {'method': 'GET', 'route': '/meets/<int:meet_id>', 'status': '200'}
+        count = REGISTRY.get_sample_value('http_request_duration_seconds_count', labels) or 0
+        self.client().get('/swimmers?limit=1', headers=headers)
+        with self.without_response_cache():
+            res = self.client().get('/meets/1', headers=headers)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('desc="1 statements"', res.headers['Server-Timing'])
+        self.assertIn('total;dur=', res.headers['Server-Timing'])
+        self.assertEqual(REGISTRY.get_sample_value('http_request_duration_seconds_count', labels), count + 1)
+
+    def test_get_meet_results_compressed(self):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        body = self.client().get('/meets/1/results', headers=headers).data
+        min_size, compression.COMPRESSION_MIN_SIZE = compression.COMPRESSION_MIN_SIZE, len(body)
+        try:
+            first = self.client().get('/meets/1/results', headers={**headers, 'Accept-Encoding': 'gzip'})
+            second = self.client().get('/meets/1/results', headers={**headers, 'Accept-Encoding': 'gzip'})
+        finally:
+            compression.COMPRESSION_MIN_SIZE = min_size
+        res = self.client().get('/meets/1/results', headers={**headers, 'If-None-Match': first.headers['ETag']})
+
+        self.assertEqual(first.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', first.headers['Vary'])
+        self.assertTrue(first.headers['ETag'].startswith('W/'))
+        self.assertEqual(gzip.decompress(first.data), body)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers['ETag'], first.headers['ETag'])
+
+    def test_get_results_stream_compressed(self):
+        headers = {'Authorization': f'Bearer {self.token}', 'Accept-Encoding': 'gzip'}
+        res = self.client().get('/results?stream=1', headers = headers)
+        rows = [json.loads(line) for line in gzip.decompress(res.data).splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertIn('time', rows[0])
+
+    def test_small_response_uncompressed(self):
+        headers = {'Authorization': f'Bearer {self.token}', 'Accept-Encoding': 'gzip'}
+        res = self.client().get('/swimmers/155849', headers=headers)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('Content-Encoding', res.headers)
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+
     '''
     Test endpoints for role based access control
     '''
@@ -417,6 +1085,499 @@ class SwimResultsTestCase(unittest.TestCase):
         self.assertFalse(data['success'])
     
 
+class TimeFormatTestCase(unittest.TestCase):
+
+    def test_time_is_parsed_to_hundredths(self):
+        self.assertEqual(parse_time('1:01.23'), 6123)
+        self.assertEqual(parse_time('45.6'), 4560)
+        self.assertEqual(parse_time('0:07'), 700)
+        self.assertRaises(ValueError, parse_time, '1:60.00')
+
+    def test_time_is_formatted_from_hundredths(self):
+        self.assertEqual(format_time(4568), '0:45.68')
+        self.assertEqual(format_time(6005), '1:00.05')
+        self.assertEqual(format_time(98765), '16:27.65')
+        self.assertEqual(format_time(612345), '102:03.45')
+
+
+class JWKSCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        """Executed before each test"""
+        self.jwks_file = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False)
+        self.write_keys('key-1')
+
+    def tearDown(self):
+        """Executed after each test"""
+        os.remove(self.jwks_file.name)
+
+    def write_keys(self, *kids):
+        keys = [{'kid': kid, 'kty': 'RSA', 'use': 'sig', 'n': 'AQAB', 'e': 'AQAB'} for kid in kids]
+        with open(self.jwks_file.name, 'w') as f:
+            json.dump({'keys': keys}, f)
+
+    def cache(self, **kwargs):
+        return JWKSCache(f'file://{self.jwks_file.name}', **kwargs)
+
+    def test_known_kid_is_cached(self):
+        cache = self.cache(ttl=600)
+        cache.get_key('key-1')
+        cache.get_key('key-1')
+
+        self.assertEqual(cache.stats['hits'], 2)
+        self.assertEqual(cache.stats['misses'], 0)
+        self.assertEqual(cache.stats['refreshes'], 1)
+
+    def test_unknown_kid_refreshes_after_cooldown(self):
+        cache = self.cache(ttl=600, refresh_cooldown=0)
+        cache.get_key('key-1')
+        self.write_keys('key-1', 'key-2')
+
+        self.assertEqual(cache.get_key('key-2')['kid'], 'key-2')
+        self.assertEqual(cache.stats['misses'], 1)
+        self.assertEqual(cache.stats['refreshes'], 2)
+
+    def test_unknown_kid_within_cooldown(self):
+        cache = self.cache(ttl=600, refresh_cooldown=600)
+        cache.get_key('key-1')
+
+        for _ in range(10):
+            self.assertIsNone(cache.get_key('bad-key'))
+        self.assertEqual(cache.stats['misses'], 10)
+        self.assertEqual(cache.stats['refreshes'], 1)
+
+    def test_key_set_from_path_or_dictionary(self):
+        keys = {'keys': [{'kid': 'key-2', 'kty': 'RSA', 'use': 'sig', 'n': 'AQAB', 'e': 'AQAB'}]}
+
+        self.assertEqual(JWKSCache(self.jwks_file.name).get_key('key-1')['kid'], 'key-1')
+        self.assertEqual(JWKSCache(keys).get_key('key-2')['kid'], 'key-2')
+
+    def test_expired_keys_served_while_revalidating(self):
+        cache = self.cache(ttl=0, max_stale=600)
+        cache.get_key('key-1')
+        os.remove(self.jwks_file.name)
+        time.sleep(0.01)
+
+        self.assertEqual(cache.get_key('key-1')['kid'], 'key-1')
+        cache._refresh_thread.join()
+        self.assertEqual(cache.stats['refresh_errors'], 1)
+        self.write_keys('key-1')
+
+
+class TokenCacheTestCase(unittest.TestCase):
+
+    def payload(self, expires_in=3600):
+        return {'exp': time.time() + expires_in, 'permissions': ['get:swimmers']}
+
+    def test_cached_token_has_permission_set(self):
+        cache = TokenCache(maxsize=10)
+        cache.put('token', self.payload())
+        verified = cache.get('token')
+
+        self.assertEqual(verified.permissions, frozenset(['get:swimmers']))
+        self.assertEqual(cache.stats['hits'], 1)
+
+    def test_expired_token_is_evicted(self):
+        cache = TokenCache(maxsize=10)
+        cache.put('token', self.payload(expires_in=-1))
+
+        self.assertIsNone(cache.get('token'))
+        self.assertEqual(cache.stats['misses'], 1)
+
+    def test_least_recently_used_token_is_evicted(self):
+        cache = TokenCache(maxsize=2)
+        cache.put('token-1', self.payload())
+        cache.put('token-2', self.payload())
+        cache.get('token-1')
+        cache.put('token-3', self.payload())
+
+        self.assertIsNotNone(cache.get('token-1'))
+        self.assertIsNone(cache.get('token-2'))
+        self.assertIsNotNone(cache.get('token-3'))
+
+
+class FakeRedis:
+    """Implements the few Redis commands used by RedisBackend on a dictionary"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+
+    def key(self, response_cache, url, tags):
+        with app.test_request_context(url):
+            return response_cache.key(tags)
+
+    def test_entry_is_stored_per_request_arguments(self):
+        response_cache = ResponseCache(LRUBackend(maxsize=10))
+        key = self.key(response_cache, '/results?stroke=Free&distance=50', ['results'])
+        response_cache.set(key, b'{}', 'application/json')
+
+        self.assertEqual(self.key(response_cache, '/results?distance=50&stroke=Free', ['results']), key)
+        self.assertNotEqual(self.key(response_cache, '/results?stroke=Back', ['results']), key)
+        self.assertEqual(response_cache.get(key), (b'{}', 'application/json'))
+
+    def test_invalidated_tag_changes_key(self):
+        response_cache = ResponseCache(LRUBackend(maxsize=10))
+        key = self.key(response_cache, '/meets/1', ['meet:1'])
+        response_cache.set(key, b'{}', 'application/json')
+        response_cache.invalidate(['meet:2'])
+        self.assertEqual(self.key(response_cache, '/meets/1', ['meet:1']), key)
+
+        response_cache.invalidate(['meet:1'])
+        new_key = self.key(response_cache, '/meets/1', ['meet:1'])
+        self.assertNotEqual(new_key, key)
+        self.assertIsNone(response_cache.get(new_key))
+
+    def test_last_modified_is_withheld_for_new_versions(self):
+        response_cache = ResponseCache(LRUBackend(maxsize=10))
+        with app.test_request_context('/meets'):
+            self.assertIsNone(response_cache.lookup(['meets'])[1])
+
+        response_cache.backend.set('v:meets', b'1.0')
+        with app.test_request_context('/meets'):
+            self.assertEqual(response_cache.lookup(['meets'])[1], datetime.datetime(1970, 1, 1))
+
+    def test_compressed_body_is_preferred(self):
+        response_cache = ResponseCache(LRUBackend(maxsize=10))
+        response_cache.set('r:1', b'{}', 'application/json')
+
+        self.assertEqual(response_cache.get_encoded('r:1', 'gzip'), (b'{}', 'application/json', None))
+        response_cache.set('r:1', b'compressed', 'application/json', 'gzip')
+        self.assertEqual(response_cache.get_encoded('r:1', 'gzip'), (b'compressed', 'application/json', 'gzip'))
+        self.assertEqual(response_cache.get('r:1'), (b'{}', 'application/json'))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        backend = LRUBackend(maxsize=2)
+        backend.set('a', b'1')
+        backend.set('b', b'2')
+        backend.get_many(['a'])
+        backend.set('c', b'3')
+
+        self.assertEqual(backend.get_many(['a', 'b', 'c']), [b'1', None, b'3'])
+
+    def test_redis_backend_shares_versions(self):
+        client = FakeRedis()
+        first = ResponseCache(RedisBackend(client))
+        second = ResponseCache(RedisBackend(client))
+        key = self.key(first, '/meets', ['meets'])
+        first.set(key, b'{}', 'application/json')
+
+        self.assertEqual(self.key(second, '/meets', ['meets']), key)
+        self.assertEqual(second.get(key), (b'{}', 'application/json'))
+        second.invalidate(['meets'])
+        self.assertNotEqual(self.key(first, '/meets', ['meets']), key)
+
+
+    def test_lagging_replica_read_is_not_cached(self):
+        self.addCleanup(setattr, cache, 'response_cache', cache.response_cache)
+        cache.response_cache = ResponseCache(LRUBackend(maxsize=10))
+        replica = {'city': 'Berlin'}
+        lagging = Flask(__name__)
+
+        @lagging.route('/meets/1')
+        @cached('meet:1')
+        def get_meet():
+            g.read_replica = True
+            return jsonify(replica)
+
+        # the city was just changed to Hamburg on the primary, the replica has yet to receive it
+        cache.invalidate(['meet:1'])
+        res = lagging.test_client().get('/meets/1')
+        self.assertEqual(res.get_json(), {'city': 'Berlin'})
+        self.assertNotEqual(res.headers['ETag'], f'"{self.key(cache.response_cache, "/meets/1", ["meet:1"])[2:]}"')
+
+        replica['city'] = 'Hamburg'
+        self.assertEqual(lagging.test_client().get('/meets/1').get_json(), {'city': 'Hamburg'})
+
+        # once the change is older than DB_REPLICA_PIN_SECONDS, replica reads are cached again
+        cache.response_cache.backend.set('v:meet:1', b'1.0')
+        lagging.test_client().get('/meets/1')
+        replica['city'] = 'Munich'
+        self.assertEqual(lagging.test_client().get('/meets/1').get_json(), {'city': 'Hamburg'})
+
+
+class CompressionTestCase(unittest.TestCase):
+
+    def test_missing_packages_fall_back_in_order(self):
+        preferred = ['zstd', 'br', 'gzip']
+
+        self.assertEqual(compression.available(preferred, {'gzip': True, 'br': False, 'zstd': False}), ['gzip'])
+        self.assertEqual(compression.available(preferred, {'gzip': True, 'br': True, 'zstd': False}), ['br', 'gzip'])
+        self.assertEqual(compression.available(['deflate', 'gzip'], compression.INSTALLED), ['gzip'])
+
+    def test_negotiate_prefers_first_available_encoding(self):
+        self.addCleanup(setattr, compression, 'ENCODINGS', compression.ENCODINGS)
+        headers = {'Accept-Encoding': 'gzip, br, zstd'}
+
+        with app.test_request_context('/meets', headers=headers):
+            compression.ENCODINGS = ['br', 'gzip']
+            self.assertEqual(compression.negotiate(), 'br')
+            compression.ENCODINGS = ['gzip']
+            self.assertEqual(compression.negotiate(), 'gzip')
+        with app.test_request_context('/meets', headers={'Accept-Encoding': 'br'}):
+            self.assertIsNone(compression.negotiate())
+
+
+class BrokerTestCase(unittest.TestCase):
+
+    def test_subscriber_receives_events_of_its_meet(self):
+        broker = Broker(max_subscribers=10, buffer_size=10, history_size=10)
+        subscription = broker.subscribe(1)
+        broker.publish(2, 'result', '{}')
+        event = broker.publish(1, 'result', '{}')
+
+        self.assertEqual(subscription.queue.get_nowait(), event)
+        self.assertTrue(subscription.queue.empty())
+
+    def test_resume_from_last_event_id(self):
+        broker = Broker(max_subscribers=10, buffer_size=10, history_size=10)
+        last = broker.publish(1, 'result', '{"id":1}')
+        broker.publish(2, 'result', '{"id":2}')
+        missed = broker.publish(1, 'delete', '{"id":1}')
+
+        self.assertEqual(broker.since(1, broker.event_id(last)), [missed])
+        self.assertIsNone(broker.since(1, 'other-1'))
+        self.assertIsNone(broker.since(1, None))
+
+    def test_resume_beyond_history(self):
+        broker = Broker(max_subscribers=10, buffer_size=10, history_size=2)
+        first = broker.publish(1, 'result', '{}')
+        for _ in range(3):
+            broker.publish(1, 'result', '{}')
+
+        self.assertIsNone(broker.since(1, broker.event_id(first)))
+
+    def test_slow_subscriber_overflows(self):
+        broker = Broker(max_subscribers=10, buffer_size=2, history_size=10)
+        subscription = broker.subscribe(1)
+        for _ in range(3):
+            broker.publish(1, 'result', '{}')
+
+        self.assertTrue(subscription.overflowed)
+        self.assertEqual(subscription.queue.qsize(), 2)
+
+    def test_subscriber_limit(self):
+        broker = Broker(max_subscribers=1, buffer_size=10, history_size=10)
+        subscription = broker.subscribe(1)
+
+        self.assertIsNone(broker.subscribe(2))
+        broker.unsubscribe(subscription)
+        self.assertIsNotNone(broker.subscribe(2))
+
+
+class FakeQuery:
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def filter(self, *criteria):
+        return self
+
+    def all(self):
+        return self.rows
+
+
+class ReadViewTestCase(unittest.TestCase):
+
+    def test_yielded_queries_get_their_rows(self):
+        @read_view
+        def view(first_id):
+            first = yield FakeQuery([first_id])
+            second = yield FakeQuery([first[0] + 1])
+            return first + second
+
+        self.assertEqual(view(1), [1, 2])
+        self.assertEqual(view.read_steps.__name__, 'view')
+
+    def test_lookup_ids_keeps_requested_order(self):
+        Row = namedtuple('Row', ['id'])
+
+        @read_view
+        def view(ids):
+            return (yield from lookup_ids(FakeQuery([Row(1), Row(3)]), Swimmer.id, ids))
+
+        self.assertEqual(view([3, 2, 1]), ([Row(3), Row(1)], [2]))
+
+    def test_response_without_query(self):
+        @read_view
+        def view():
+            return 'response'
+            yield
+
+        self.assertEqual(view(), 'response')
+
+
+class PoolMetricsTestCase(unittest.TestCase):
+
+    def sample(self, name):
+        return REGISTRY.get_sample_value(name) or 0
+
+    def test_checkout_wait_and_timeout(self):
+        pool = TimedQueuePool(lambda: sqlite3.connect(':memory:'), pool_size=1, max_overflow=0, timeout=0.01)
+        waits = self.sample('db_pool_checkout_waits_total')
+        timeouts = self.sample('db_pool_checkout_timeouts_total')
+        checkouts = self.sample('db_pool_checkout_seconds_count')
+
+        connection = pool.connect()
+        self.assertEqual(self.sample('db_pool_checkout_waits_total'), waits)
+        with self.assertRaises(exc.TimeoutError):
+            pool.connect()
+        connection.close()
+
+        self.assertEqual(self.sample('db_pool_checkout_waits_total'), waits + 1)
+        self.assertEqual(self.sample('db_pool_checkout_timeouts_total'), timeouts + 1)
+        self.assertEqual(self.sample('db_pool_checkout_seconds_count'), checkouts + 2)
+
+
+class ReplicaSetTestCase(unittest.TestCase):
+
+    def test_round_robin_skips_ejected(self):
+        replica_set = ReplicaSet(['a', 'b', 'c'], eject_seconds=60)
+        self.assertEqual([replica_set.choose() for _ in range(4)], ['a', 'b', 'c', 'a'])
+
+        replica_set.eject('b')
+        self.assertEqual([replica_set.choose() for _ in range(3)], ['c', 'a', 'c'])
+
+    def test_ejected_replica_returns(self):
+        replica_set = ReplicaSet(['a'], eject_seconds=0.01)
+        replica_set.eject('a')
+        self.assertIsNone(replica_set.choose())
+
+        time.sleep(0.02)
+        self.assertEqual(replica_set.choose(), 'a')
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.pins = replicas.pins
+        replicas.pins = WriterPins(LRUBackend(), seconds=60)
+
+    def tearDown(self):
+        replicas.pins = self.pins
+
+    def view(self, permission):
+        def view():
+            pass
+        view.permission = permission
+        return view
+
+    def test_reads_from_replica(self):
+        headers = {'Authorization': 'Bearer a'}
+        self.assertTrue(replicas.reads_from_replica(self.view('get:meets'), 'GET', headers))
+        self.assertFalse(replicas.reads_from_replica(self.view('edit:meet'), 'GET', headers))
+        self.assertFalse(replicas.reads_from_replica(self.view('get:meets'), 'POST', headers))
+        self.assertFalse(replicas.reads_from_replica(None, 'GET', headers))
+
+    def test_writer_reads_from_primary(self):
+        view = self.view('get:meets')
+        replicas.pins.pin(replicas.client_key({'Authorization': 'Bearer a'}))
+
+        self.assertFalse(replicas.reads_from_replica(view, 'GET', {'Authorization': 'Bearer a'}))
+        self.assertTrue(replicas.reads_from_replica(view, 'GET', {'Authorization': 'Bearer b'}))
+
+
+class ClosedDatabase:
+    """Database of asgi.py whose connection was closed by the server"""
+
+    async def connect(self):
+        pass
+
+    async def disconnect(self):
+        pass
+
+    async def fetch_all(self, statement):
+        raise ConnectionDoesNotExistError('connection was closed in the middle of operation')
+
+
+class AsgiTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.headers = {'Authorization': f'Bearer {TOKENS[0]}'}
+        self.replicas = asgi.replicas
+        self.pins = replicas.pins
+        # the reads are to run on the asyncpg pool, not be served from the cache
+        self.response_cache, cache.response_cache = cache.response_cache, None
+
+    def tearDown(self):
+        asgi.replicas = self.replicas
+        replicas.pins = self.pins
+        cache.response_cache = self.response_cache
+
+    def count_finalized(self):
+        """Returns the status codes of the responses passed to the after-request hooks"""
+        finalized = []
+
+        def after_request(response):
+            finalized.append(response.status_code)
+            return response
+
+        app.after_request_funcs.setdefault(None, []).append(after_request)
+        self.addCleanup(app.after_request_funcs[None].remove, after_request)
+        return finalized
+
+    def test_get_swimmers(self):
+        expected = app.test_client().get('/swimmers?limit=2', headers=self.headers).get_json()
+        with TestClient(asgi.app) as client:
+            res = client.get('/swimmers?limit=2', headers=self.headers)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json(), expected)
+
+    def test_get_swimmer_details(self):
+        expected = app.test_client().get('/swimmers/155849', headers=self.headers).get_json()
+        with TestClient(asgi.app) as client:
+            res = client.get('/swimmers/155849', headers=self.headers)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json(), expected)
+
+    def test_get_swimmer_details_not_found(self):
+        finalized = self.count_finalized()
+        with TestClient(asgi.app) as client:
+            res = client.get('/swimmers/1000000', headers=self.headers)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertFalse(res.json()['success'])
+        self.assertEqual(finalized, [404])
+
+    def test_closed_replica_is_ejected(self):
+        replica = ClosedDatabase()
+        asgi.replicas = ReplicaSet([replica], eject_seconds=60)
+        replicas.pins = WriterPins(LRUBackend())
+        finalized = self.count_finalized()
+        with TestClient(asgi.app) as client:
+            res = client.get('/swimmers/155849', headers=self.headers)
+
+        self.assertEqual(res.status_code, 500)
+        self.assertIsNone(asgi.replicas.choose())
+        self.assertEqual(finalized, [500])
+
+    def test_fetch_ejects_replica_on_interface_error(self):
+        replica = ClosedDatabase()
+        asgi.replicas = ReplicaSet([replica], eject_seconds=60)
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        with self.assertRaises(ConnectionDoesNotExistError):
+            loop.run_until_complete(asgi.fetch(replica, 'SELECT 1'))
+        self.assertIsNone(asgi.replicas.choose())
+
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,85 @@
+import os
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from metrics import (REQUEST_SECONDS, REQUEST_DB_SECONDS, REQUEST_SQL_STATEMENTS,
+                     REQUEST_AUTH_SECONDS, REQUEST_SERIALIZE_SECONDS)
+
+
+# adds a Server-Timing header with the phases below to every response, 0 to leave it out
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '1') == '1'
+PHASES = ('db', 'auth', 'serialize')
+
+
+def record(phase, seconds):
+    """Adds time spent in a phase to the current request
+    """
+    if has_request_context() and 'timings' in g:
+        g.timings[phase] += seconds
+
+
+@contextmanager
+def timed(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - start)
+
+
+def _start_statement(conn, cursor, statement, parameters, context, executemany):
+    conn.info['statement_start'] = time.perf_counter()
+
+
+def _end_statement(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop('statement_start', None)
+    if start is not None and has_request_context() and 'timings' in g:
+        g.timings['db'] += time.perf_counter() - start
+        g.sql_statements += 1
+
+
+def _start_request():
+    g.request_start = time.perf_counter()
+    g.timings = dict.fromkeys(PHASES, 0.0)
+    g.sql_statements = 0
+
+
+def _finish_request(response):
+    if 'request_start' not in g:
+        return response
+    total = time.perf_counter() - g.request_start
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    timings = g.timings
+
+    REQUEST_SECONDS.labels(request.method, route, response.status_code).observe(total)
+    REQUEST_DB_SECONDS.labels(request.method, route).observe(timings['db'])
+    REQUEST_SQL_STATEMENTS.labels(request.method, route).observe(g.sql_statements)
+    REQUEST_AUTH_SECONDS.labels(request.method, route).observe(timings['auth'])
+    REQUEST_SERIALIZE_SECONDS.labels(request.method, route).observe(timings['serialize'])
+
+    if SERVER_TIMING:
+        response.headers.add(
+            'Server-Timing',
+            f'db;dur={timings["db"] * 1000:.2f};desc="{g.sql_statements} statements", '
+            f'auth;dur={timings["auth"] * 1000:.2f}, '
+            f'serialize;dur={timings["serialize"] * 1000:.2f}, '
+            f'total;dur={total * 1000:.2f}')
+    return response
+
+
+def setup_timing(app):
+    """Measures every request and its time in SQL statements, authentication and serialization
+
+    The phases are reported per route in the request metrics of metrics.py
+    and, unless SERVER_TIMING is off, in a Server-Timing header. Streamed
+    response bodies are sent after the measurement ends.
+    """
+    if _start_request not in app.before_request_funcs.get(None, []):
+        app.before_request(_start_request)
+        app.after_request(_finish_request)
+    if not event.contains(Engine, 'before_cursor_execute', _start_statement):
+        event.listen(Engine, 'before_cursor_execute', _start_statement)
+        event.listen(Engine, 'after_cursor_execute', _end_statement)